@@ -18,10 +18,22 @@ Requirements:
 
 Usage:
     python evalswing.py --input mygame.pgn
+    python evalswing.py --input mygame.pgn --where "White~Stockfish and Result=1-0"
+    python evalswing.py --input mygame.pgn --swing-plies 4 --top 20
+    python evalswing.py --input mygame.pgn --accuracy
+    python evalswing.py --input mygame.pgn --dedup
+    python evalswing.py --input human_games.pgn --lichess --engine stockfish --engine-workers 4
+    python evalswing.py --input rounds/ --workers 8
+    python evalswing.py --input "archive/**/*.pgn" --tcec
+    python evalswing.py --input archive.pgn --shard 1/4
+    python evalswing.py --merge "evalswing_archive_shard_*_of_4.json"
+    python evalswing.py --input archive.pgn --tcec --ingest evals.sqlite
+    python evalswing.py --input-db evals.sqlite --accuracy
+    python evalswing.py --input big_archive.pgn --sample 2000 --seed 7
 """
 
 
-__version__ = 'v0.5.0'
+__version__ = 'v0.16.0'
 __author__ = 'fsmosca'
 __credits__ = ['rwbc']
 __script_name__ = 'evalswing'
@@ -29,44 +41,254 @@ __goal__ = 'Read pgn file and print max/min eval of each engine per game.'
 
 
 import argparse
+import glob
+import heapq
+import json
+import os
+import random
+import sqlite3
+import sys
 import time
-from typing import List, Set, Dict, Tuple, Optional
+from array import array
+from itertools import groupby
+from operator import itemgetter
+from typing import Optional, Sequence
 from pathlib import Path
 
 import chess.pgn
 from chess.engine import Mate
+import numpy as np
 import pandas as pd
 
+# Code shared by the scripts is in scripts/pgncommon.
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'pgncommon'))
+from pgn_common import (ENGINE_DEPTH, EngineAnalyzer, Quarantine, SeenGames, TooManyErrors, check_partials,
+                        expand_inputs, game_fingerprint, match_where, output_name, parse_shard, parse_where,
+                        run_batch, spov_score)
+from pgn_series import GameSeries
+from pgn_time import clock_to_movetime, get_time, time_control
+
+
+SWING_BATCH_SIZE = 1000  # Number of games whose evals are scanned at once.
+NAN = float('nan')
+ACPL_CAP = 1000  # Evals are capped to +/- this many centipawns for --accuracy.
+INGEST_BATCH_SIZE = 100000  # Number of move rows inserted per transaction.
+GAME_COLUMNS = ('Event', 'Site', 'Date', 'Round', 'White', 'Black', 'Result')
+DRAW_SWING_EVAL = 1.0  # A draw has a swing if a side had at least this eval in pawn unit.
+Z_95 = 1.959964  # Normal quantile of the 95% confidence intervals of --sample.
+
+
+class EvalStore:
+    """
+    Sqlite store of the game headers and the per ply move, eval, depth and
+    time of each game, for queries without parsing the pgn again.
+
+    Games are keyed by the absolute path of the source and byte offset,
+    a file that grew can be loaded again and only its new games are
+    added. Rows are inserted with executemany in one transaction per
+    INGEST_BATCH_SIZE moves, a game and its moves are always in the same
+    transaction.
+    """
+
+    def __init__(self, db):
+        self.con = sqlite3.connect(db)
+        self.con.executescript('''
+            CREATE TABLE IF NOT EXISTS games (
+                id INTEGER PRIMARY KEY, source TEXT, offset INTEGER, num INTEGER,
+                event TEXT, site TEXT, date TEXT, round TEXT,
+                white TEXT, black TEXT, result TEXT, start_ply INTEGER,
+                UNIQUE (source, offset));
+            CREATE TABLE IF NOT EXISTS headers (
+                game INTEGER, tag TEXT, value TEXT,
+                PRIMARY KEY (game, tag)) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS moves (
+                game INTEGER, ply INTEGER, move_num INTEGER, move TEXT,
+                eval REAL, depth INTEGER, time REAL,
+                PRIMARY KEY (game, ply)) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS games_white ON games (white);
+            CREATE INDEX IF NOT EXISTS games_black ON games (black);
+            CREATE INDEX IF NOT EXISTS games_result ON games (result);
+            CREATE INDEX IF NOT EXISTS games_date ON games (date);
+            CREATE INDEX IF NOT EXISTS moves_move_num ON moves (move_num);
+        ''')
+        self.next_id = self.con.execute('SELECT COALESCE(MAX(id), 0) + 1 FROM games').fetchone()[0]
+        self.games, self.headers, self.moves = [], [], []
+
+    def offsets(self, source):
+        """
+        Returns the byte offsets of the games loaded from source.
+        """
+        cur = self.con.execute('SELECT offset FROM games WHERE source = ?', (source,))
+        return {offset for offset, in cur}
+
+    def sources(self):
+        """
+        Returns the sources of the games in the store.
+        """
+        return [source for source, in self.con.execute('SELECT DISTINCT source FROM games')]
+
+    def add(self, source, offset, headers, series, moves, depths):
+        """
+        Queue one game, evals are in SPOV of the side that moved.
+        """
+        gid = self.next_id
+        self.next_id += 1
+
+        self.games.append((gid, source, offset, series.num, series.event, headers.get('Site', '?'),
+                           series.date, series.round, series.white, series.black,
+                           series.result, series.start_ply))
+        self.headers += [(gid, k, v) for k, v in headers.items() if k not in GAME_COLUMNS]
+
+        w, b = 0, 0
+        for i, move in enumerate(moves):
+            ply = series.start_ply + i
+            if ply % 2:
+                move_eval, move_time = series.b_eval[b], series.b_time[b]
+                b += 1
+            else:
+                move_eval, move_time = series.w_eval[w], series.w_time[w]
+                w += 1
+            self.moves.append((gid, ply, ply // 2 + 1, move, db_value(move_eval),
+                               depths[i], db_value(move_time)))
+
+        if len(self.moves) >= INGEST_BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        with self.con:
+            self.con.executemany('INSERT INTO games VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', self.games)
+            self.con.executemany('INSERT INTO headers VALUES (?, ?, ?)', self.headers)
+            self.con.executemany('INSERT INTO moves VALUES (?, ?, ?, ?, ?, ?, ?)', self.moves)
+        self.games, self.headers, self.moves = [], [], []
+
+    def read_series(self):
+        """
+        Yield (source, headers, moves in uci, GameSeries) of every game in
+        id order, the game number of the series is its number in the source.
+        The games, headers and moves tables are read in one ordered pass
+        each.
+        """
+        games = self.con.execute('SELECT id, num, source, event, site, date, round, white, black, result,'
+                                 ' start_ply FROM games ORDER BY id')
+        headers = groupby(self.con.execute('SELECT game, tag, value FROM headers ORDER BY game'),
+                          key=itemgetter(0))
+        moves = groupby(self.con.execute('SELECT game, ply, move, eval, time FROM moves'
+                                         ' ORDER BY game, ply'), key=itemgetter(0))
+        h_id, h_rows = next(headers, (None, ()))
+        m_id, m_rows = next(moves, (None, ()))
+
+        for gid, num, source, *values, start_ply in games:
+            tags = dict(zip(GAME_COLUMNS, values))
+            if h_id == gid:
+                tags.update((tag, value) for _, tag, value in h_rows)
+                h_id, h_rows = next(headers, (None, ()))
+
+            rows = ()
+            if m_id == gid:
+                rows = list(m_rows)
+                m_id, m_rows = next(moves, (None, ()))
+
+            series = GameSeries(num, tags, start_ply)
+            for _, ply, _, move_eval, move_time in rows:
+                move_eval = NAN if move_eval is None else move_eval
+                move_time = NAN if move_time is None else move_time
+                if ply % 2:
+                    series.b_eval.append(move_eval)
+                    series.b_time.append(move_time)
+                else:
+                    series.w_eval.append(move_eval)
+                    series.w_time.append(move_time)
+                    series.move_num.append(ply // 2 + 1)
+
+            yield source, tags, [move for _, _, move, _, _ in rows], series
+
+    def close(self):
+        self.flush()
+        self.con.close()
+
 
 class EvalSwing:
     def __init__(self, input_pgn, min_depth=1, tcec=False, lichess=False,
-                 chessbase=False, spov=True, save_game=False):
+                 chessbase=False, spov=True, save_game=False, where=None,
+                 swing_plies=None, top=20, dedup=False, dedup_headers='', dedup_db=None,
+                 engine=None, engine_workers=1, engine_depth=None, engine_nodes=None,
+                 engine_cache=None, max_errors=None, shard=None, accuracy=False,
+                 ingest=None, from_db=False, sample=None, sample_frac=None, seed=1,
+                 input_root=None, verbose=True):
         self.input_pgn = input_pgn
+        self.verbose = verbose
         self.min_depth = min_depth
         self.tcec = tcec
         self.lichess = lichess
         self.chessbase=chessbase
         self.spov = spov
         self.save_game = save_game
-        self.output_fn = f'out_{Path(input_pgn).name}'
-
-        self.num = []
+        self.where = parse_where(where)
+        self.swing_plies = swing_plies
+        self.top = top
+        self.seen = SeenGames(dedup_db) if dedup else None
+        self.dedup_headers = [t.strip() for t in dedup_headers.split(',') if t.strip()]
+        self.duplicates = 0
+        self.analyzer = None
+        if engine is not None:
+            self.analyzer = EngineAnalyzer(engine, workers=engine_workers, depth=engine_depth,
+                                           nodes=engine_nodes, cache=engine_cache)
+        self.output_fn = output_name('out_', input_pgn, input_root)
+        self.quarantine = Quarantine(input_pgn, output_name('quarantine_', input_pgn, input_root, shard), max_errors)
+        self.shard = shard
+
+        # Settings that must be the same in all shards of a run.
+        self.settings = {'min_depth': min_depth, 'tcec': tcec, 'lichess': lichess,
+                         'chessbase': chessbase, 'spov': spov, 'where': where,
+                         'swing_plies': swing_plies, 'top': top, 'accuracy': accuracy, 'dedup': dedup,
+                         'dedup_headers': dedup_headers, 'engine_depth': engine_depth,
+                         'engine_nodes': engine_nodes}
+
+        # Table columns, evals are nan and move indexes are -1 if not shown.
+        self.num = array('I')
         self.wnames = []
         self.bnames = []
 
-        self.w_min_eval = []
-        self.w_max_eval = []
+        self.w_min_eval = array('f')
+        self.w_max_eval = array('f')
 
-        self.b_min_eval = []
-        self.b_max_eval = []
+        self.b_min_eval = array('f')
+        self.b_max_eval = array('f')
 
         self.res = []
 
-        self.w_mi_min = []
-        self.w_mi_max = []
+        self.w_mi_min = array('i')
+        self.w_mi_max = array('i')
+
+        self.b_mi_min = array('i')
+        self.b_mi_max = array('i')
+
+        # Swing mode, games waiting to be scanned and a min-heap of the
+        # largest swings found so far.
+        self.swing_batch = []
+        self.swings = []
+
+        # Sqlite store to load the games into, or input_pgn is a store.
+        self.ingest_db = ingest
+        self.from_db = from_db
+
+        # Source file of the game being added, shown in a File column when
+        # the games are read from a store of several files.
+        self.source = None
+        self.files = []
+
+        # Accuracy mode, games waiting to be scored and the scored batches.
+        self.accuracy = accuracy
+        self.accuracy_batch = []
+        self.accuracy_parts = []
 
-        self.b_mi_min = []
-        self.b_mi_max = []
+        # Sample mode, number or fraction of the games to evaluate, the
+        # number of games chosen and the number they were drawn from.
+        self.sample = sample
+        self.sample_frac = sample_frac
+        self.seed = seed
+        self.sampled = 0
+        self.population = 0
 
     def get_eval(
             self,
@@ -74,8 +296,8 @@ class EvalSwing:
             comment: str,
             turn: bool,
             ply: int,
-            black_eval: List[float],
-            white_eval: List[float]
+            black_eval: Sequence[float],
+            white_eval: Sequence[float]
     ) -> Optional[float]:
         """
         Returns move_eval with SPOV in pawn unit.
@@ -173,8 +395,7 @@ class EvalSwing:
                     try:
                         depth = int(comment.split()[0].split('/')[1])
                     except ValueError:
-                        print(comment)
-                        raise
+                        raise ValueError(f'Unexpected comment {comment!r}') from None
                     if depth >= self.min_depth:
                         move_eval = float(comment.split('/')[0])
 
@@ -195,194 +416,868 @@ class EvalSwing:
 
         return -1
 
-    def evaluate(self, game, cnt):
+    def get_depth(self, comment):
         """
-        Read game get eval in the move comment and plot it.
+        Returns the search depth in the move comment or None.
         """
-        if self.save_game:
-            my_game = chess.pgn.Game()
-            my_node = my_game
+        try:
+            if self.tcec:
+                # d=30, sd=50, mt=12345, ...
+                if 'd=' not in comment:
+                    return None
+                return int(comment.split('d=')[1].split(',')[0])
+
+            if self.chessbase:
+                # [%eval 8,38]
+                if '[%eval ' not in comment:
+                    return None
+                _, _, depth = comment.split('%eval ')[1].split(']')[0].partition(',')
+                return int(depth) if depth else None
+
+            if self.lichess:
+                return None
+
+            # +0.35/20 0.5s
+            first = comment.split()[0] if comment.strip() else ''
+            if '/' not in first:
+                return None
+            return int(first.split('/')[1])
+        except (IndexError, ValueError):
+            return None
 
-            for k, v in game.headers.items():
-                my_game.headers[k] = v
+    def has_eval(self, comment):
+        """
+        Returns True if the move comment has an eval in the input format.
+        """
+        if comment.strip() == '' or 'book' in comment.lower():
+            return False
+        if self.tcec:
+            return 'wv=' in comment
+        if self.lichess or self.chessbase:
+            return '[%eval ' in comment
+        return '/' in comment.split()[0]
 
-        wp = game.headers['White']
-        bp = game.headers['Black']
-        res = game.headers['Result']
+    def engine_evals(self, game):
+        """
+        Returns {ply: eval} with eval in SPOV of the side that made the move
+        in pawn unit, for the moves without an eval in the comment.
+        """
+        boards = {}
+        board = game.board()
+        for node in game.mainline():
+            ply = board.ply()
+            board.push(node.move)
+            if not self.has_eval(node.comment):
+                boards[ply] = board.copy(stack=False)
 
-        move_num, b_eval, w_eval = [], [], []
+        return self.analyzer.move_evals(boards)
+
+    def parse_game(self, game, cnt=0, times=False):
+        """
+        Returns the GameSeries of the game mainline with white and black
+        evals in SPOV, and the time spent per move if times is True.
+        """
+        series = GameSeries(cnt, game.headers, game.board().ply())
+        move_num, b_eval, w_eval = series.move_num, series.b_eval, series.w_eval
+        engine_evals = {} if self.analyzer is None else self.engine_evals(game)
+
+        # One board is pushed along the mainline, node.board() would replay
+        # the game from the start at every move.
+        board = game.board()
         for node in game.mainline():
-            board = node.board()
-            parent_node = node.parent
-            parent_board = parent_node.board()
             comment = node.comment
-            fmvn = parent_board.fullmove_number
-            ply = parent_board.ply()
+            fmvn = board.fullmove_number
+            ply = board.ply()
+            turn = board.turn
+            board.push(node.move)
 
-            if self.save_game:
-                my_node = my_node.add_main_variation(
-                    node.move, comment=node.comment)
-
-            move_eval = self.get_eval(board, comment, parent_board.turn, ply, b_eval, w_eval)
+            if ply in engine_evals:
+                move_eval = engine_evals[ply]
+            else:
+                move_eval = self.get_eval(board, comment, turn, ply, b_eval, w_eval)
+            if move_eval is None:
+                move_eval = NAN
 
             # Side POV
             # Black
             if ply % 2:
-                if move_eval is None:
-                    b_eval.append(None)
-                else:
-                    b_eval.append(move_eval)
+                b_eval.append(move_eval)
             # White
             else:
                 w_eval.append(move_eval)
                 move_num.append(fmvn)
 
-        self.num.append(cnt)
+            if times:
+                (series.b_time if ply % 2 else series.w_time).append(get_time(comment, self.tcec, self.lichess))
+
+        if times and self.lichess:
+            base, inc = time_control(game.headers.get('TimeControl', '-'))
+            series.w_time = clock_to_movetime(series.w_time, base, inc)
+            series.b_time = clock_to_movetime(series.b_time, base, inc)
+
+        return series
 
-        self.wnames.append(wp)
-        self.bnames.append(bp)
+    def evaluate(self, game, series):
+        """
+        Add the min/max evals of the game series to the table, and save the
+        game with them in the headers if save_game is set.
+        """
+        if self.save_game:
+            my_game = chess.pgn.Game()
+            my_node = my_game
 
-        if res == '1-0':
-            try:
-                minv = min(x for x in w_eval if x is not None)
-            except ValueError:
-                minv = 0
+            for k, v in game.headers.items():
+                my_game.headers[k] = v
 
-            self.w_min_eval.append(minv)
-            self.w_max_eval.append(None)
+            for node in game.mainline():
+                my_node = my_node.add_main_variation(
+                    node.move, comment=node.comment)
 
-            mimin = self.move_index(w_eval, minv, is_min=True) + 1
-            self.w_mi_min.append(mimin)
-            self.w_mi_max.append('-')
+        w_eval, b_eval = self.add_min_max(series)
 
-        elif res == '0-1':
-            try:
-                maxv = max(x for x in w_eval if x is not None)
-            except ValueError:
-                maxv = 0
+        if self.save_game:
+            my_game.headers['WhiteMaxEval'] = eval_header(w_eval, is_max=True)
+            my_game.headers['BlackMaxEval'] = eval_header(b_eval, is_max=True)
+            my_game.headers['WhiteMinEval'] = eval_header(w_eval, is_max=False)
+            my_game.headers['BlackMinEval'] = eval_header(b_eval, is_max=False)
 
-            self.w_max_eval.append(maxv)
-            self.w_min_eval.append(None)
+            with open(self.output_fn, 'a', encoding='utf-8') as w:
+                w.write(f'{my_game}\n\n')
 
-            mimax = self.move_index(w_eval, maxv, is_min=False) + 1
-            self.w_mi_min.append('-')
-            self.w_mi_max.append(mimax)
-        else:
-            try:
-                minv = min(x for x in w_eval if x is not None)
-            except ValueError:
-                minv = 0
-
-            try:
-                maxv = max(x for x in w_eval if x is not None)
-            except ValueError:
-                maxv = 0
-
-            mimin = self.move_index(w_eval, minv, is_min=True) + 1
-            mimax = self.move_index(w_eval, maxv, is_min=False) + 1
-
-            self.w_min_eval.append(minv)
-            self.w_max_eval.append(maxv)
-
-            self.w_mi_min.append(mimin)
-            self.w_mi_max.append(mimax)
-
-        if res == '0-1':
-            try:
-                minv = min(x for x in b_eval if x is not None)
-            except ValueError:
-                minv = 0
-
-            self.b_min_eval.append(minv)
-            self.b_max_eval.append(None)
-
-            mimin = self.move_index(b_eval, minv, is_min=True) + 1
-            self.b_mi_min.append(mimin)
-            self.b_mi_max.append('-')
-
-        elif res == '1-0':
-            try:
-                maxv = max(x for x in b_eval if x is not None)
-            except ValueError:
-                maxv = 0
-
-            self.b_max_eval.append(maxv)
-            self.b_min_eval.append(None)
-
-            mimax = self.move_index(b_eval, maxv, is_min=False) + 1
-            self.b_mi_min.append('-')
-            self.b_mi_max.append(mimax)
+    def add_min_max(self, series):
+        """
+        Append the min/max evals of the game to the table columns. Returns
+        the white and black evals.
+        """
+        res = series.result
+        w_eval = np.frombuffer(series.w_eval, dtype=np.float32)
+        b_eval = np.frombuffer(series.b_eval, dtype=np.float32)
+
+        self.num.append(series.num)
+        self.files.append(self.source)
+
+        self.wnames.append(series.white)
+        self.bnames.append(series.black)
+
+        # White min eval is shown if white did not lose, max eval if white did not win.
+        self.min_max(w_eval, res != '0-1', True, self.w_min_eval, self.w_mi_min)
+        self.min_max(w_eval, res != '1-0', False, self.w_max_eval, self.w_mi_max)
+
+        self.min_max(b_eval, res != '1-0', True, self.b_min_eval, self.b_mi_min)
+        self.min_max(b_eval, res != '0-1', False, self.b_max_eval, self.b_mi_max)
+
+        self.res.append(series.result)
+
+        return w_eval, b_eval
+
+    def min_max(self, values, show, is_min, evals, move_indexes):
+        """
+        Append the min or max of values and its move index to the table
+        columns, or nan and -1 if it is not shown for this result.
+        """
+        if not show:
+            evals.append(NAN)
+            move_indexes.append(-1)
+            return
+
+        valid = values[~np.isnan(values)]
+        if len(valid):
+            val = float(valid.min() if is_min else valid.max())
         else:
-            try:
-                minv = min(x for x in b_eval if x is not None)
-            except ValueError:
-                minv = 0
+            val = 0
 
-            try:
-                maxv = max(x for x in b_eval if x is not None)
-            except ValueError:
-                maxv = 0
+        evals.append(val)
+        move_indexes.append(self.move_index(values, val, is_min=is_min) + 1)
 
-            mimin = self.move_index(b_eval, minv, is_min=True) + 1
-            mimax = self.move_index(b_eval, maxv, is_min=False) + 1
+    def table(self):
+        """
+        Returns the min/max eval table as a dataframe.
+        """
+        def moves(col):
+            return ['-' if i < 0 else i for i in col]
 
-            self.b_min_eval.append(minv)
-            self.b_max_eval.append(maxv)
+        def evals(col):
+            # Shortest float32 repr gives back the eval as written in the pgn.
+            return np.frombuffer(col, dtype=np.float32).astype(str).astype(np.float64)
 
-            self.b_mi_min.append(mimin)
-            self.b_mi_max.append(mimax)
+        data = {'File': self.files, '#': self.num, 'White': self.wnames, 'Black': self.bnames, 'Res': self.res,
+                'WMaxMove': moves(self.w_mi_max), 'WMaxEval': evals(self.w_max_eval),
+                'WMinMove': moves(self.w_mi_min), 'WMinEval': evals(self.w_min_eval),
+                'BMaxMove': moves(self.b_mi_max), 'BMaxEval': evals(self.b_max_eval),
+                'BMinMove': moves(self.b_mi_min), 'BMinEval': evals(self.b_min_eval)}
 
-        self.res.append(res)
+        return pd.DataFrame(data)
 
-        data = {'#': self.num, 'White': self.wnames, 'Black': self.bnames, 'Res': self.res,
-                'WMaxMove': self.w_mi_max, 'WMaxEval': self.w_max_eval, 'WMinMove': self.w_mi_min, 'WMinEval': self.w_min_eval,
-                'BMaxMove': self.b_mi_max, 'BMaxEval': self.b_max_eval, 'BMinMove': self.b_mi_min, 'BMinEval': self.b_min_eval}
-        df = pd.DataFrame(data)
+    def add_swing_series(self, series):
+        """
+        Queue the per ply evals of the game for the swing scan.
+        """
+        info = (series.num, series.white, series.black, series.result, series.start_ply, self.source)
+        self.swing_batch.append((info, series.wpov_evals()))
 
-        if self.save_game:
-            my_game.headers['WhiteMaxEval'] = str(max([i for i in w_eval if i is not None]))
-            my_game.headers['BlackMaxEval'] = str(max([i for i in b_eval if i is not None]))
-            my_game.headers['WhiteMinEval'] = str(min([i for i in w_eval if i is not None]))
-            my_game.headers['BlackMinEval'] = str(min([i for i in b_eval if i is not None]))
+        if len(self.swing_batch) >= SWING_BATCH_SIZE:
+            self.flush_swings()
 
-            with open(self.output_fn, 'a') as w:
-                w.write(f'{my_game}\n\n')
+    def flush_swings(self):
+        """
+        Find the largest eval change within swing_plies plies of every
+        queued game and keep the top games in the heap.
 
-        return df
+        The evals of the batch are concatenated into one array, the change
+        at each lag is taken over the whole array and changes that cross
+        a game boundary or touch a missing eval are masked out.
+        """
+        if not self.swing_batch:
+            return
+
+        infos = [info for info, _ in self.swing_batch]
+        evals = np.concatenate([e for _, e in self.swing_batch])
+        lengths = [len(e) for _, e in self.swing_batch]
+        self.swing_batch = []
+
+        n = len(evals)
+        if n == 0:
+            return
+
+        gid = np.repeat(np.arange(len(infos)), lengths)
+        best = np.zeros(n)
+        best_lag = np.zeros(n, dtype=np.int64)
+
+        for lag in range(1, min(self.swing_plies, n - 1) + 1):
+            delta = np.abs(evals[lag:] - evals[:-lag])
+            delta[gid[lag:] != gid[:-lag]] = np.nan
+            better = delta > best[:-lag]  # nan compares False
+            best[:-lag][better] = delta[better]
+            best_lag[:-lag][better] = lag
+
+        # Index of the largest swing in each game.
+        order = np.lexsort((-best, gid))
+        first = np.ones(n, dtype=bool)
+        first[1:] = gid[order][1:] != gid[order][:-1]
+        idx = order[first]
+
+        idx = idx[best[idx] > 0]
+        if len(self.swings) >= self.top:
+            idx = idx[best[idx] > self.swings[0][0]]
+
+        for i in idx:
+            g = gid[i]
+            item = (float(best[i]), infos[g][0], infos[g],
+                    int(i - np.searchsorted(gid, g)), int(best_lag[i]),
+                    float(evals[i]), float(evals[i + best_lag[i]]))
+            if len(self.swings) < self.top:
+                heapq.heappush(self.swings, item)
+            else:
+                heapq.heappushpop(self.swings, item)
+
+    def swing_table(self):
+        """
+        Returns the top swings as a dataframe, largest first.
+        """
+        self.flush_swings()
+
+        rows = []
+        for swing, _, info, i, lag, before, after in sorted(self.swings, reverse=True):
+            cnt, wp, bp, res, start_ply, source = info
+            rows.append({
+                'File': source, '#': cnt, 'White': wp, 'Black': bp, 'Res': res,
+                'Against': 'White' if after < before else 'Black',
+                'From': move_label(start_ply + i + 1),
+                'To': move_label(start_ply + i + lag),
+                'EvalBefore': round(before, 2), 'EvalAfter': round(after, 2),
+                'Swing': round(swing, 2)})
+
+        return pd.DataFrame(rows)
+
+    def add_accuracy_series(self, series):
+        """
+        Queue the per ply evals of the game for accuracy scoring.
+        """
+        info = (series.num, series.white, series.black, series.result, self.source)
+        self.accuracy_batch.append((info, series.start_ply, series.wpov_evals()))
+
+        if len(self.accuracy_batch) >= SWING_BATCH_SIZE:
+            self.flush_accuracy()
+
+    def flush_accuracy(self):
+        """
+        Score every move of the queued games at once.
+
+        The eval before a move is the eval of the previous ply, both are
+        taken in the POV of the side that moved, capped to ACPL_CAP and
+        converted to win probability. The centipawn loss and the win
+        probability loss of each move are summed per game and side with
+        one bincount over the whole batch.
+        """
+        if not self.accuracy_batch:
+            return
+
+        infos = [info for info, _, _ in self.accuracy_batch]
+        starts = np.array([start for _, start, _ in self.accuracy_batch])
+        lengths = np.array([len(e) for _, _, e in self.accuracy_batch])
+        evals = np.concatenate([e for _, _, e in self.accuracy_batch]).astype(np.float64)
+        self.accuracy_batch = []
+
+        gid = np.repeat(np.arange(len(infos)), lengths)
+        ply = np.arange(len(evals)) - np.repeat(np.cumsum(lengths) - lengths, lengths) + starts[gid]
+        black = ply % 2
+        sign = 1 - 2 * black
+
+        before = np.full(len(evals), np.nan)
+        before[1:] = evals[:-1]
+        before[1:][gid[1:] != gid[:-1]] = np.nan
+
+        valid = ~np.isnan(before) & ~np.isnan(evals)
+        cp_before = np.clip(sign * before * 100, -ACPL_CAP, ACPL_CAP)[valid]
+        cp_after = np.clip(sign * evals * 100, -ACPL_CAP, ACPL_CAP)[valid]
+
+        cp_loss = np.maximum(0, cp_before - cp_after)
+        wp_loss = np.maximum(0, win_probability(cp_before) - win_probability(cp_after))
+        acc = np.clip(103.1668 * np.exp(-0.04354 * wp_loss) - 3.1669, 0, 100)
+
+        key = (gid * 2 + black)[valid]
+        size = 2 * len(infos)
+        moves = np.bincount(key, minlength=size)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            acpl = np.bincount(key, weights=cp_loss, minlength=size) / moves
+            accuracy = np.bincount(key, weights=acc, minlength=size) / moves
+
+        self.accuracy_parts.append((infos, moves.reshape(-1, 2), accuracy.reshape(-1, 2),
+                                    acpl.reshape(-1, 2)))
+
+    def accuracy_table(self):
+        """
+        Returns the moves scored, accuracy and average centipawn loss of
+        each side per game as a dataframe.
+        """
+        self.flush_accuracy()
+
+        if not self.accuracy_parts:
+            return None
+
+        infos = [info for part in self.accuracy_parts for info in part[0]]
+        moves, accuracy, acpl = (np.concatenate([part[k] for part in self.accuracy_parts])
+                                 for k in (1, 2, 3))
+
+        data = {'File': [i[4] for i in infos], '#': [i[0] for i in infos], 'White': [i[1] for i in infos],
+                'Black': [i[2] for i in infos], 'Res': [i[3] for i in infos],
+                'WMoves': moves[:, 0], 'WAcc': accuracy[:, 0].round(1), 'WACPL': acpl[:, 0].round(1),
+                'BMoves': moves[:, 1], 'BAcc': accuracy[:, 1].round(1), 'BACPL': acpl[:, 1].round(1)}
+
+        return pd.DataFrame(data)
+
+    def add_series(self, series):
+        """
+        Add a game read from the store to the report of the current mode.
+        """
+        if self.swing_plies is not None:
+            self.add_swing_series(series)
+        elif self.accuracy:
+            self.add_accuracy_series(series)
+        else:
+            self.add_min_max(series)
+
+    def is_duplicate(self, moves, headers, cnt):
+        """
+        Returns True if the game moves in uci were seen in an earlier game.
+        """
+        first = self.seen.add(game_fingerprint(moves, headers, self.dedup_headers), cnt)
+        if first is None:
+            return False
+
+        self.duplicates += 1
+        print(f'game: {cnt} is a duplicate of game {first}, skipped')
+        return True
+
+    def select_games(self, pgn):
+        """
+        Yield (game number, game) of the games that pass the --where filter.
+
+        Games are numbered as in an unfiltered run. When a filter is set only
+        the headers of a game are parsed first, the movetext of rejected
+        games is skipped. With --dedup repeated games are skipped too. With
+        --shard the games of other shards are skipped without parsing.
+
+        The byte offsets of the game yielded are in self.game_span for the
+        quarantine.
+        """
+        if self.sample is not None or self.sample_frac is not None:
+            yield from self.sample_games(pgn)
+            return
 
-    def run(self):
-        start_time = time.perf_counter()
         cnt = 0
-        df = None
+        while True:
+            if self.shard is not None and cnt % self.shard[1] != self.shard[0] - 1:
+                if not chess.pgn.skip_game(pgn):
+                    break
+                cnt += 1
+                continue
 
-        with open(self.input_pgn) as pgn:
-            while True:
+            offset = pgn.tell()
+
+            if not self.where:
                 game = chess.pgn.read_game(pgn)
                 if game is None:
                     break
+                cnt += 1
+            else:
+                headers = chess.pgn.read_headers(pgn)
+                if headers is None:
+                    break
 
                 cnt += 1
 
-                print(f'game: {cnt}')
+                if not match_where(headers, self.where):
+                    continue
+
+                pgn.seek(offset)
+                game = chess.pgn.read_game(pgn)
+
+            self.game_span = (offset, pgn.tell())
+
+            if self.seen is not None and self.is_duplicate(
+                    [m.uci() for m in game.mainline_moves()], game.headers, cnt):
+                continue
+
+            yield cnt, game
+
+    def sample_games(self, pgn):
+        """
+        Yield (game number, game) of a random sample of the games that pass
+        the --where filter.
+
+        Only the headers are read in a first pass that keeps the byte offset
+        of the chosen games, --sample N keeps a reservoir of N games and
+        --sample-frac p takes each game with probability p. The chosen games
+        are then read in file order.
+        """
+        rng = random.Random(self.seed)
+        chosen = []
+        cnt = 0
+
+        while True:
+            offset = pgn.tell()
+            headers = chess.pgn.read_headers(pgn)
+            if headers is None:
+                break
 
-                df = self.evaluate(game, cnt)
+            cnt += 1
+
+            if self.where and not match_where(headers, self.where):
+                continue
+
+            self.population += 1
+
+            if self.sample_frac is not None:
+                if rng.random() < self.sample_frac:
+                    chosen.append((cnt, offset))
+            elif len(chosen) < self.sample:
+                chosen.append((cnt, offset))
+            else:
+                i = rng.randrange(self.population)
+                if i < self.sample:
+                    chosen[i] = (cnt, offset)
+
+        self.sampled = len(chosen)
+        for cnt, offset in sorted(chosen):
+            pgn.seek(offset)
+            game = chess.pgn.read_game(pgn)
+            self.game_span = (offset, pgn.tell())
+
+            if self.seen is not None and self.is_duplicate(
+                    [m.uci() for m in game.mainline_moves()], game.headers, cnt):
+                continue
+
+            yield cnt, game
+
+    def process(self):
+        """
+        Read all games and returns the table, or None if there is no game.
+        """
+        df = None
 
-        if df is not None:
+        if self.from_db:
+            self.process_store()
+        else:
+            # Bytes that are not utf-8 are read as U+FFFD and tell() is a
+            # byte offset, see Quarantine.
+            with open(self.input_pgn, encoding='utf-8', errors='replace') as pgn:
+                for cnt, game in self.select_games(pgn):
+                    if self.verbose:
+                        print(f'game: {cnt}')
+
+                    # The swing and accuracy batches are flushed outside of
+                    # the per game guard, a failed flush is not the fault of
+                    # this game.
+                    try:
+                        series = self.parse_game(game, cnt)
+                    except Exception as e:
+                        self.quarantine.add(cnt, *self.game_span, e)
+                        continue
+
+                    if self.swing_plies is not None:
+                        self.add_swing_series(series)
+                    elif self.accuracy:
+                        self.add_accuracy_series(series)
+                    else:
+                        self.evaluate(game, series)
+
+        if self.swing_plies is not None:
+            df = self.swing_table()
+        elif self.accuracy:
+            df = self.accuracy_table()
+        elif len(self.num):
+            df = self.table()
+
+        if df is not None and not self.from_db:
+            df = df.drop(columns='File', errors='ignore')
+
+        if self.seen is not None:
+            self.seen.close()
+
+        if self.analyzer is not None:
+            self.analyzer.close()
+
+        self.quarantine.close()
+
+        return df
+
+    def process_store(self):
+        """
+        Add the games of the sqlite store in input_pgn that pass the
+        --where filter and --dedup, with their source file and game number
+        in it.
+        """
+        store = EvalStore(self.input_pgn)
+
+        # Sources are shown relative to their common folder as in a batch.
+        sources = store.sources()
+        root = os.path.commonpath([os.path.dirname(src) for src in sources]) if sources else ''
+        names = {src: os.path.relpath(src, root) for src in sources}
+
+        for source, headers, moves, series in store.read_series():
+            self.source = names[source]
+
+            if self.where and not match_where(headers, self.where):
+                continue
+
+            if self.seen is not None and self.is_duplicate(moves, headers, series.num):
+                continue
+
+            if self.verbose:
+                print(f'game: {series.num}')
+
+            self.add_series(series)
+
+        store.close()
+
+    def ingest(self, db):
+        """
+        Load the headers and the per ply move, eval, depth and time of every
+        game into the sqlite store db. Games of this file already in the
+        store are skipped by their byte offset without parsing. Returns
+        the number of games added and skipped.
+        """
+        store = EvalStore(db)
+        source = str(Path(self.input_pgn).resolve())
+        loaded = store.offsets(source)
+        cnt, added, skipped = 0, 0, 0
+
+        try:
+            with open(self.input_pgn, encoding='utf-8', errors='replace') as pgn:
+                while True:
+                    offset = pgn.tell()
+                    if offset in loaded:
+                        if not chess.pgn.skip_game(pgn):
+                            break
+                        cnt += 1
+                        skipped += 1
+                        continue
+
+                    game = chess.pgn.read_game(pgn)
+                    if game is None:
+                        break
+
+                    cnt += 1
+                    if self.verbose:
+                        print(f'game: {cnt}')
+
+                    try:
+                        series = self.parse_game(game, cnt, times=True)
+                        depths = [self.get_depth(node.comment) for node in game.mainline()]
+                        moves = [m.uci() for m in game.mainline_moves()]
+                    except Exception as e:
+                        self.quarantine.add(cnt, offset, pgn.tell(), e)
+                        continue
+
+                    store.add(source, offset, game.headers, series, moves, depths)
+                    added += 1
+        finally:
+            store.close()
+            self.quarantine.close()
+            if self.analyzer is not None:
+                self.analyzer.close()
+
+        return added, skipped
+
+    def write_partial(self, df):
+        """
+        Save the table rows of this shard with their global game numbers
+        in a json file that also records the input, shard and settings.
+        Returns the filename, see merge_partials().
+        """
+        i, n = self.shard
+        fn = f'evalswing_{Path(self.input_pgn).stem}_shard_{i}_of_{n}.json'
+
+        rows, keys = [], []
+        if df is not None and len(df):
+            rows = df.astype(object).where(df.notna(), None).values.tolist()
+        if self.swing_plies is not None:
+            # Unrounded swing and game number, to rank rows of all shards.
+            keys = [[item[0], item[1]] for item in sorted(self.swings, reverse=True)]
+
+        partial = {'script': __script_name__, 'version': __version__,
+                   'input': Path(self.input_pgn).name,
+                   'input_size': os.path.getsize(self.input_pgn),
+                   'shard': i, 'shards': n, 'settings': self.settings,
+                   'columns': [] if df is None else list(df.columns),
+                   'rows': rows, 'keys': keys,
+                   'errors': self.quarantine.errors}
+
+        with open(fn, 'w') as f:
+            json.dump(partial, f)
+
+        return fn
+
+    def run(self):
+        start_time = time.perf_counter()
+
+        try:
+            if self.ingest_db is not None:
+                added, skipped = self.ingest(self.ingest_db)
+                print(f'Added {added} games to {self.ingest_db}, {skipped} games were already there')
+                df = None
+            else:
+                df = self.process()
+        except TooManyErrors as e:
+            print(f'Aborted {self.input_pgn}: {e}')
+            return
+
+        if self.shard is not None:
+            print(f'Saved {self.write_partial(df)}')
+        elif df is not None:
             print(df.to_string(index=False))
+            if self.accuracy:
+                print(accuracy_summary(df).to_string(index=False))
+
+        if self.sample is not None or self.sample_frac is not None:
+            print(f'Sampled {self.sampled} of {self.population} games, seed: {self.seed}')
+            if df is not None and self.swing_plies is None:
+                print(sample_estimates(df, self.accuracy).to_string(index=False))
+
+        if self.seen is not None:
+            print(f'Duplicates skipped: {self.duplicates}')
 
         print(f'Done {self.input_pgn}, Elapse (sec): {time.perf_counter() - start_time:0.3f}')
 
 
-def spov_score(wpov_score, stm):
-    return wpov_score if stm else -wpov_score
+def evalswing_file(input_pgn, input_root, options):
+    """
+    Process one pgn file of a batch in a worker process.
+    """
+    return EvalSwing(input_pgn, input_root=input_root, verbose=False, **options).process()
+
+
+def batch_table(results, options):
+    """
+    Print one table of the files of a batch with the source file of each
+    game.
+    """
+    tables = []
+    for fn, root, df in results:
+        if df is not None and len(df):
+            df.insert(0, 'File', os.path.relpath(fn, root))
+            tables.append(df)
+
+    if tables:
+        df = pd.concat(tables, ignore_index=True)
+        if options.get('swing_plies') is not None:
+            df = df.sort_values('Swing', ascending=False, kind='stable').head(options.get('top', 20))
+        print(df.to_string(index=False))
+        if options.get('accuracy'):
+            print(accuracy_summary(df).to_string(index=False))
+
+
+def merge_partials(files):
+    """
+    Print the table of a sharded run from the partial files of its shards,
+    in game order or, with --swing-plies, the top swings of all shards.
+    """
+    start_time = time.perf_counter()
+
+    parts = []
+    for fn in files:
+        with open(fn) as f:
+            parts.append((fn, json.load(f)))
+
+    check_partials(parts, __script_name__)
+
+    first = parts[0][1]
+    settings = first['settings']
+    columns = next((p['columns'] for _, p in parts if p['columns']), [])
+
+    if settings['swing_plies'] is not None:
+        items = [(key, row) for _, p in parts for key, row in zip(p['keys'], p['rows'])]
+        items.sort(key=lambda item: item[0], reverse=True)
+        rows = [row for _, row in items[0:settings['top']]]
+    else:
+        rows = sorted((row for _, p in parts for row in p['rows']), key=lambda row: row[0])
+
+    if rows:
+        df = pd.DataFrame(rows, columns=columns)
+        print(df.to_string(index=False))
+        if settings['accuracy']:
+            print(accuracy_summary(df).to_string(index=False))
+
+    errors = sum(p['errors'] for _, p in parts)
+    if errors:
+        print(f'Errors: {errors}, see the quarantine files of the shards')
+
+    print(f'Done merge of {len(parts)} shards of {first["input"]}, '
+          f'Elapse (sec): {time.perf_counter() - start_time:0.3f}')
+
+
+def eval_header(values, is_max):
+    """
+    Returns the max or min of the float32 evals as written in the pgn for
+    the --save-game headers, or an empty value if the side has no eval.
+    """
+    valid = values[~np.isnan(values)]
+    if not len(valid):
+        return ''
+
+    return str(valid.max() if is_max else valid.min())
+
+
+def db_value(value):
+    """
+    Returns a float32 series value for sqlite, None for nan. Rounding
+    gives back the value as written in the pgn.
+    """
+    return None if value != value else round(value, 6)
+
+
+def win_probability(cp):
+    """
+    Returns the win probability in percent of the side with the given
+    centipawn eval, logistic model fitted on lichess games.
+    """
+    return 50 + 50 * (2 / (1 + np.exp(-0.00368208 * cp)) - 1)
+
+
+def accuracy_summary(df):
+    """
+    Returns per engine the games, moves scored, average game accuracy and
+    average centipawn loss over all moves from an --accuracy table.
+    """
+    sides = []
+    for side, name in (('W', 'White'), ('B', 'Black')):
+        part = df[[name, f'{side}Moves', f'{side}Acc', f'{side}ACPL']]
+        part.columns = ['Engine', 'Moves', 'Acc', 'ACPL']
+        sides.append(part)
+
+    d = pd.concat(sides)
+    d = d[d['Moves'] > 0].assign(Loss=lambda x: x['ACPL'] * x['Moves'])
+
+    g = d.groupby('Engine').agg(Games=('Moves', 'size'), Moves=('Moves', 'sum'),
+                                Acc=('Acc', 'mean'), Loss=('Loss', 'sum'))
+    g['Acc'] = g['Acc'].round(1)
+    g['ACPL'] = (g['Loss'] / g['Moves']).round(1)
+
+    return g.drop(columns='Loss').sort_values('Acc', ascending=False).reset_index()
+
+
+def mean_interval(values):
+    """
+    Returns the mean of values and its 95% confidence interval.
+    """
+    values = values[~np.isnan(values)]
+    n = len(values)
+    if n == 0:
+        return 0, NAN, NAN, NAN
+
+    mean = float(values.mean())
+    if n == 1:
+        return n, mean, NAN, NAN
+
+    half = Z_95 * float(values.std(ddof=1)) / np.sqrt(n)
+
+    return n, mean, mean - half, mean + half
+
+
+def wilson_interval(hits, n):
+    """
+    Returns the proportion in percent of hits in n and its 95% Wilson
+    score interval, which stays inside 0 to 100 for small n and rare hits.
+    """
+    if n == 0:
+        return 0, NAN, NAN, NAN
+
+    p = hits / n
+    z2 = Z_95 * Z_95
+    center = (p + z2 / (2 * n)) / (1 + z2 / n)
+    half = Z_95 * np.sqrt(p * (1 - p) / n + z2 / (4 * n * n)) / (1 + z2 / n)
+
+    return n, 100 * p, 100 * (center - half), 100 * (center + half)
+
+
+def sample_estimates(df, accuracy=False):
+    """
+    Returns the estimates of the whole file from the table of a --sample
+    run, with the number of games or sides each is taken from and the
+    bounds of its 95% confidence interval.
+    """
+    rows = []
+
+    if accuracy:
+        for name, col in (('Accuracy', 'Acc'), ('ACPL', 'ACPL')):
+            values = np.concatenate([df[f'W{col}'].to_numpy(float), df[f'B{col}'].to_numpy(float)])
+            rows.append((name, *mean_interval(values)))
+    else:
+        wins, losses, draws = df['Res'] == '1-0', df['Res'] == '0-1', df['Res'] == '1/2-1/2'
+        decided = wins | losses
+        loser_max = np.where(wins, df['BMaxEval'], df['WMaxEval'])[decided]
+        winner_min = np.where(wins, df['WMinEval'], df['BMinEval'])[decided]
+        draw_max = np.fmax(df['WMaxEval'], df['BMaxEval'])[draws].to_numpy(float)
+
+        rows.append(('Loser max eval', *mean_interval(loser_max.astype(float))))
+        rows.append(('Winner min eval', *mean_interval(winner_min.astype(float))))
+        rows.append(('Decisive games %', *wilson_interval(int(decided.sum()), int((decided | draws).sum()))))
+        rows.append((f'Draws with eval >= {DRAW_SWING_EVAL} %',
+                     *wilson_interval(int((draw_max >= DRAW_SWING_EVAL).sum()), int(draws.sum()))))
+
+    est = pd.DataFrame(rows, columns=['Estimate', 'N', 'Value', 'Low95', 'High95'])
+
+    return est.round({'Value': 2, 'Low95': 2, 'High95': 2})
+
+
+def move_label(ply):
+    """
+    Returns the move number of the move played at the given ply
+    as 12. for white or 12... for black.
+    """
+    return f'{ply // 2 + 1}.' if ply % 2 == 0 else f'{ply // 2 + 1}...'
 
 
 def main():
     parser = argparse.ArgumentParser(
         prog='%s %s' % (__script_name__, __version__),
         description=__goal__, epilog='%(prog)s')
-    parser.add_argument('--input', required=True, type=str,
-                        help='Input pgn filename (required).')
+    parser.add_argument('--input', required=False, type=str, nargs='+',
+                        help='Input pgn filename (required). Folders and glob patterns like '
+                             '"archive/**/*.pgn" are processed in a batch with one merged table.')
+    parser.add_argument('--workers', required=False, type=int,
+                        help='Number of worker processes in a batch, default is the number of cpus.')
     parser.add_argument('--min-depth',
                         required=False, type=int,
                         default=1,
@@ -402,22 +1297,169 @@ def main():
     parser.add_argument('--save-game',
                         action='store_true',
                         help='Use this flag to save the game in pgn with min/max eval placed in header.')
+    parser.add_argument('--where', required=False, type=str,
+                        help='Only process games whose headers match this filter, example: '
+                             '"White~Stockfish and Result=1-0 and Date>=2023.01.01". '
+                             'Operators: = != ~ (contains) !~ < <= > >=. Game numbers are kept '
+                             'as in an unfiltered run.')
+    parser.add_argument('--swing-plies', required=False, type=int,
+                        help='Report the largest eval change within this number of plies '
+                             'instead of the min/max eval table, example 4 (not required).')
+    parser.add_argument('--top', required=False, type=int, default=20,
+                        help='Number of games to show in the --swing-plies report, default=20.')
+    parser.add_argument('--accuracy',
+                        action='store_true',
+                        help='Report the accuracy and average centipawn loss of each side per game '
+                             'and per engine instead of the min/max eval table.')
+    parser.add_argument('--dedup',
+                        action='store_true',
+                        help='Skip games whose moves are the same as an earlier game.')
+    parser.add_argument('--dedup-headers', required=False, type=str, default='',
+                        help='Comma separated header tags that are also compared by --dedup, '
+                             'example White,Black (not required).')
+    parser.add_argument('--dedup-db', required=False, type=str,
+                        help='Keep the --dedup fingerprints in this sqlite file instead of memory (not required).')
+    parser.add_argument('--engine', required=False, type=str,
+                        help='Uci engine path, moves without an eval in the comment are analysed '
+                             'by this engine (not required).')
+    parser.add_argument('--engine-workers', required=False, type=int, default=1,
+                        help='Number of engine processes, default=1.')
+    parser.add_argument('--engine-depth', required=False, type=int,
+                        help=f'Engine search depth, default={ENGINE_DEPTH} if --engine-nodes is not set.')
+    parser.add_argument('--engine-nodes', required=False, type=int,
+                        help='Engine search nodes (not required).')
+    parser.add_argument('--engine-cache', required=False, type=str,
+                        help='Sqlite file where engine scores are kept across runs (not required).')
+    parser.add_argument('--max-errors', required=False, type=int,
+                        help='Stop when more than this number of games fail, default is no limit. '
+                             'Games that fail are saved in quarantine_<input> with a log.')
+    parser.add_argument('--ingest', required=False, type=str,
+                        help='Load the headers and the move, eval, depth and time of each ply into '
+                             'this sqlite file instead of printing a table. Games already loaded '
+                             'from the same file are skipped.')
+    parser.add_argument('--input-db', required=False, type=str,
+                        help='Read the games from a sqlite file made by --ingest instead of --input.')
+    parser.add_argument('--sample', required=False, type=int,
+                        help='Evaluate a random sample of this number of games and print estimates '
+                             'with 95%% confidence intervals (not required).')
+    parser.add_argument('--sample-frac', required=False, type=float,
+                        help='Evaluate each game with this probability, example 0.01, and print '
+                             'estimates with 95%% confidence intervals (not required).')
+    parser.add_argument('--seed', required=False, type=int, default=1,
+                        help='Random seed of --sample and --sample-frac, default=1.')
+    parser.add_argument('--shard', required=False, type=str,
+                        help='Process only shard i of N of the input, example 2/8. Game n is in shard '
+                             '(n - 1) %% N + 1. The rows are saved in evalswing_<input>_shard_<i>_of_<N>.json '
+                             'for --merge.')
+    parser.add_argument('--merge', required=False, type=str, nargs='+',
+                        help='Print the table from the json files or glob pattern of all --shard runs.')
     parser.add_argument('-v', '--version', action='version',
                         version=f'{__version__}')
 
     args = parser.parse_args()
     spov = False if args.wpov else True
 
-    a = EvalSwing(
-        args.input,
+    if args.merge is not None:
+        files = [fn for item in args.merge for fn in (sorted(glob.glob(item)) or [item])]
+        try:
+            merge_partials(files)
+        except ValueError as e:
+            sys.exit(f'Merge failed: {e}')
+        return
+
+    if args.accuracy and args.swing_plies is not None:
+        parser.error('--accuracy and --swing-plies can not be used together.')
+    if args.swing_plies is not None and args.swing_plies < 1:
+        parser.error('--swing-plies must be at least 1.')
+    if args.top < 1:
+        parser.error('--top must be at least 1.')
+
+    sampling = args.sample is not None or args.sample_frac is not None
+    if sampling:
+        if args.sample is not None and args.sample_frac is not None:
+            parser.error('--sample and --sample-frac can not be used together.')
+        if args.sample is not None and args.sample < 1:
+            parser.error('--sample must be at least 1.')
+        if args.sample_frac is not None and not 0 < args.sample_frac <= 1:
+            parser.error('--sample-frac must be above 0 and at most 1.')
+        if args.input_db is not None or args.ingest is not None or args.shard is not None:
+            parser.error('--sample and --sample-frac can not be used with --input-db, --ingest or --shard.')
+
+    if args.input_db is not None:
+        if args.input is not None or args.ingest is not None:
+            parser.error('--input-db can not be used with --input or --ingest.')
+        if args.engine is not None or args.save_game or args.shard is not None:
+            parser.error('--engine, --save-game and --shard need --input.')
+        options = dict(where=args.where, swing_plies=args.swing_plies, top=args.top,
+                       accuracy=args.accuracy, dedup=args.dedup, dedup_headers=args.dedup_headers,
+                       dedup_db=args.dedup_db, from_db=True)
+        EvalSwing(args.input_db, **options).run()
+        return
+
+    if args.input is None:
+        parser.error('the following arguments are required: --input')
+
+    if args.ingest is not None and (args.shard is not None or args.where or args.dedup):
+        parser.error('--ingest loads all games, --shard, --where and --dedup are not supported. '
+                     'Use --where and --dedup when reading the store with --input-db.')
+
+    shard = None
+    if args.shard is not None:
+        if args.dedup:
+            parser.error('--dedup can not be used with --shard, a duplicate can be in another shard.')
+        try:
+            shard = parse_shard(args.shard)
+        except ValueError as e:
+            parser.error(str(e))
+
+    options = dict(
         min_depth = args.min_depth,
         tcec=args.tcec,
         lichess=args.lichess,
         chessbase=args.chessbase,
         spov=spov,
-        save_game=args.save_game)
-
-    a.run()
+        save_game=args.save_game,
+        where=args.where,
+        swing_plies=args.swing_plies,
+        top=args.top,
+        dedup=args.dedup,
+        dedup_headers=args.dedup_headers,
+        dedup_db=args.dedup_db,
+        engine=args.engine,
+        engine_workers=args.engine_workers,
+        engine_depth=args.engine_depth,
+        engine_nodes=args.engine_nodes,
+        engine_cache=args.engine_cache,
+        max_errors=args.max_errors,
+        shard=shard,
+        accuracy=args.accuracy,
+        ingest=args.ingest,
+        sample=args.sample,
+        sample_frac=args.sample_frac,
+        seed=args.seed)
+
+    if len(args.input) == 1 and Path(args.input[0]).is_file():
+        a = EvalSwing(args.input[0], **options)
+        a.run()
+        return
+
+    if shard is not None:
+        parser.error('--shard is supported for one input file.')
+
+    if sampling:
+        parser.error('--sample and --sample-frac are supported for one input file.')
+
+    if args.ingest is not None:
+        # Sqlite has one writer, the files are loaded one after the other.
+        for fn, root in expand_inputs(args.input):
+            EvalSwing(fn, input_root=root, **options).run()
+        return
+
+    if args.dedup_db is not None:
+        parser.error('--dedup-db is not supported in a batch, --dedup is done per file.')
+
+    run_batch(expand_inputs(args.input), evalswing_file, options, args.workers,
+              report=lambda results: batch_table(results, options))
 
 
 if __name__ == "__main__":
@@ -10,44 +10,71 @@ Requirements:
 
 
 import argparse
+import os
+import sys
+from pathlib import Path
 
 import chess.pgn
 
+# Code shared by the scripts is in scripts/pgncommon.
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'pgncommon'))
+from pgn_common import Quarantine, TooManyErrors, swap_tags
 
-tags_to_swap = ['White', 'Black', 'Result', 'WhiteElo', 'BlackElo',
-                'WhiteFideId', 'BlackFideId', 'WhiteTitle', 'BlackTitle']
 
-
-def swap_tags(game, fgame):
+def flip_game(game):
     """
-    Swap some header tags.
+    Returns the game with flipped board and moves.
     """
-    fgame.headers['White'] = game.headers.get('Black', '?')
-    fgame.headers['Black'] = game.headers.get('White', '?')
+    root_board = game.board()
+    fb = root_board.mirror()
+
+    for node in game.mainline():
+        move = node.move
+
+        # Flip the move.
+        from_sq = chess.Move.from_uci(str(move)).from_square
+        to_sq = chess.Move.from_uci(str(move)).to_square
+        promo_pc = chess.Move.from_uci(str(move)).promotion
+
+        from_sq_mirror = chess.square_mirror(from_sq)
+        to_sq_mirror = chess.square_mirror(to_sq)
+
+        # Save the flipped move.
+        fb.push(chess.Move(from_sq_mirror, to_sq_mirror, promotion=promo_pc))
+
+    # Convert the flipped board into a game.
+    fgame = chess.pgn.Game().from_board(fb)
 
-    if game.headers['Result'] == '1-0':
-        fgame.headers['Result'] = '0-1'
-    elif game.headers['Result'] == '0-1':
-        fgame.headers['Result'] = '1-0'
-    else:
-        fgame.headers['Result'] = game.headers.get('Result', '*')
+    return swap_tags(game, fgame)
 
-    fgame.headers['WhiteElo'] = game.headers.get('BlackElo', '?')
-    fgame.headers['BlackElo'] = game.headers.get('WhiteElo', '?')
 
-    fgame.headers['WhiteFideId'] = game.headers.get('BlackFideId', '?')
-    fgame.headers['BlackFideId'] = game.headers.get('WhiteFideId', '?')
+def flip_file(pgninfn, pgnoutfn, quarantine):
+    """
+    Flip all games, a game that fails is saved in quarantine.
+    """
+    cnt = 0
+
+    # Bytes that are not utf-8 are written back as they are, and tell()
+    # is the byte offset of a game.
+    with open(pgninfn, encoding='utf-8', errors='surrogateescape') as pgn:
+        while True:
+            start = pgn.tell()
+            game = chess.pgn.read_game(pgn)
+            if game is None:
+                break
 
-    fgame.headers['WhiteTitle'] = game.headers.get('BlackTitle', '?')
-    fgame.headers['BlackTitle'] = game.headers.get('WhiteTitle', '?')
+            cnt += 1
 
-    # Update tags.
-    for k, v in game.headers.items():
-        if k in tags_to_swap:
-            continue
-        fgame.headers[k] = v
+            try:
+                fgame = flip_game(game)
+                text = f'{fgame}\n\n'
+            except Exception as e:
+                quarantine.add(cnt, start, pgn.tell(), e)
+                continue
 
-    return fgame
+            # Save to file.
+            with open(pgnoutfn, 'a', encoding='utf-8', errors='surrogateescape') as f:
+                f.write(text)
 
 
 def main():
@@ -57,6 +84,9 @@ def main():
     parser.add_argument('--output', required=False,
                         help='Output pgn filename. If not specified'
                              ' it will be written in out_<input>.pgn')
+    parser.add_argument('--max-errors', required=False, type=int,
+                        help='Stop when more than this number of games fail, default is no limit.'
+                             ' Games that fail are saved in quarantine_<input> with a log.')
 
     args = parser.parse_args()
 
@@ -66,38 +96,14 @@ def main():
     if pgnoutfn is None:
         pgnoutfn = f'out_{pgninfn}'
     
-    with open(pgninfn) as pgn:
-        while True:
-            game = chess.pgn.read_game(pgn)
-            if game is None:
-                break
-            
-            root_board = game.board()
-            fb = root_board.mirror()
-            
-            for node in game.mainline():
-                move = node.move
-
-                # Flip the move.
-                from_sq = chess.Move.from_uci(str(move)).from_square
-                to_sq = chess.Move.from_uci(str(move)).to_square
-                promo_pc = chess.Move.from_uci(str(move)).promotion
-                
-                from_sq_mirror = chess.square_mirror(from_sq)
-                to_sq_mirror = chess.square_mirror(to_sq)
-
-                # Save the flipped move.
-                fb.push(chess.Move(from_sq_mirror, to_sq_mirror, promotion=promo_pc))
+    quarantine = Quarantine(pgninfn, f'quarantine_{os.path.basename(pgninfn)}', args.max_errors)
 
-            # Convert the flipped board into a game.
-            fgame = chess.pgn.Game().from_board(fb)
+    try:
+        flip_file(pgninfn, pgnoutfn, quarantine)
+    except TooManyErrors as e:
+        print(f'Aborted {pgninfn}: {e}')
+    quarantine.close()
 
-            fgame = swap_tags(game, fgame)
-
-            # Save to file.
-            with open(pgnoutfn, 'a') as f:
-                f.write(f'{fgame}\n\n')
-            
 
 if __name__ == '__main__':
     main()
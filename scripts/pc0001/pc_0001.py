@@ -16,13 +16,21 @@ Requirements:
 """
 
 
-__version__ = 'v0.1.0'
+__version__ = 'v0.2.0'
 __script_name__ = 'pc_0001'
 
 
 import argparse
+import os
+import sys
+from pathlib import Path
+
 import chess.pgn
 
+# Code shared by the scripts is in scripts/pgncommon.
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'pgncommon'))
+from pgn_common import Quarantine, TooManyErrors
+
 
 def pc_0001(game, outfn, no_nag_ply=1):
     """
@@ -44,7 +52,7 @@ def pc_0001(game, outfn, no_nag_ply=1):
         else:
             my_node = my_node.add_variation(game_move, nags=node.nags)
 
-    with open(outfn, 'a') as w:
+    with open(outfn, 'a', encoding='utf-8', errors='surrogateescape') as w:
         w.write(f'{my_game}\n\n')
 
 
@@ -60,6 +68,9 @@ def main():
     parser.add_argument('--no-nag-ply', required=False, type=int,
                         help='Do not write nag if game ply is below this option value. Default=1.',
                         default=1)
+    parser.add_argument('--max-errors', required=False, type=int,
+                        help='Stop when more than this number of games fail, default is no limit. '
+                             'Games that fail are saved in quarantine_<input> with a log.')
 
     args = parser.parse_args()
 
@@ -69,13 +80,29 @@ def main():
     if outfn is None:
         outfn = f'out_{infn}'
 
-    with open(args.input) as pgnh:
-        while True:
-            game = chess.pgn.read_game(pgnh)
-            if game is None:
-                break
-
-            pc_0001(game, outfn, args.no_nag_ply)
+    quarantine = Quarantine(infn, f'quarantine_{os.path.basename(infn)}', args.max_errors)
+    cnt = 0
+
+    # Bytes that are not utf-8 are kept by surrogateescape, tell() is the
+    # byte offset of a game.
+    try:
+        with open(args.input, encoding='utf-8', errors='surrogateescape') as pgnh:
+            while True:
+                start = pgnh.tell()
+                game = chess.pgn.read_game(pgnh)
+                if game is None:
+                    break
+
+                cnt += 1
+
+                try:
+                    pc_0001(game, outfn, args.no_nag_ply)
+                except Exception as e:
+                    quarantine.add(cnt, start, pgnh.tell(), e)
+    except TooManyErrors as e:
+        print(f'Aborted {infn}: {e}')
+
+    quarantine.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,463 @@
+#!/usr/bin/env python
+
+
+"""
+pgn_bin.py
+
+Convert pgn files to and from a compact binary archive of mainline moves.
+
+A game is its header tags and a uint16 array of moves encoded as
+from | to << 6 | promotion << 12. All moves are in one array, game i has
+the moves moves[game_index[i]:game_index[i+1]] and its tags in the header
+blob at header_index[i]. The arrays are read with numpy.memmap, so a game
+can be read without loading the archive.
+
+File layout, little endian:
+  file header   magic, version, counts and section positions (72 bytes)
+  moves         uint16[n_moves]
+  headers       tag and value separated by NUL, one block per game
+  game index    uint64[n_games + 1], position in moves
+  header index  uint64[n_games + 1], position in headers
+
+Comments, nags and variations are not saved.
+
+
+Setup:
+  Install python 3.8 or newer
+
+
+Requirements:
+  python-chess==1.2.0
+  numpy
+
+
+Usage:
+    python pgn_bin.py --input games.pgn
+    python pgn_bin.py --input games.pgnbin --output flipped.pgnbin --flip
+    python pgn_bin.py --input games.pgnbin --output games_out.pgn --workers 8
+"""
+
+
+__version__ = 'v0.1.0'
+__script_name__ = 'pgnbin'
+__goal__ = 'Convert pgn files to and from a compact binary archive of mainline moves.'
+
+
+import argparse
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import chess.pgn
+import numpy as np
+
+# Code shared by the scripts is in scripts/pgncommon.
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'pgncommon'))
+from pgn_common import Quarantine, TooManyErrors, tags_to_swap
+
+
+MAGIC = b'PGNBIN\x00\x00'
+FORMAT_VERSION = 1
+FILE_HEADER = struct.Struct('<8sIIQQQQQQQ')  # 72 bytes
+assert FILE_HEADER.size == 72
+BIN_EXT = '.pgnbin'
+
+# The from and to square bits, square_mirror() is sq ^ 0x38.
+FLIP_MASK = 0x38 | 0x38 << 6
+
+MOVES_BATCH_SIZE = 1 << 20
+GAMES_PER_TASK = 2000
+
+class MovesVisitor(chess.pgn.BaseVisitor):
+    """
+    Collect the headers and the encoded mainline moves of a game without
+    building the game tree. An error is kept so that the rest of the game
+    is still read and the next game starts at the right place.
+    """
+    def begin_game(self):
+        self.headers = {}
+        self.moves = array('H')
+        self.error = None
+
+    def visit_header(self, tagname, tagvalue):
+        self.headers[tagname] = tagvalue
+
+    def begin_variation(self):
+        return chess.pgn.SKIP
+
+    def visit_move(self, board, move):
+        if move.drop:
+            self.handle_error(ValueError(f'Drop move {move.uci()} is not supported'))
+        self.moves.append(encode_move(move))
+
+    def handle_error(self, error):
+        if self.error is None:
+            self.error = error
+
+    def result(self):
+        return self
+
+
+class PgnBin:
+    """
+    Read only view of a binary archive, the sections are memory mapped.
+    """
+    def __init__(self, fn):
+        self.fn = fn
+
+        with open(fn, 'rb') as f:
+            (magic, version, self.flags, self.n_games, self.n_moves, moves_pos,
+             headers_pos, headers_size, game_index_pos,
+             header_index_pos) = FILE_HEADER.unpack(f.read(FILE_HEADER.size))
+
+        if magic != MAGIC:
+            raise ValueError(f'{fn} is not a {BIN_EXT} file')
+        if version != FORMAT_VERSION:
+            raise ValueError(f'{fn} has format version {version}, expected {FORMAT_VERSION}')
+
+        self.moves = self.section('<u2', moves_pos, self.n_moves)
+        self.headers_blob = self.section('u1', headers_pos, headers_size)
+        self.game_index = self.section('<u8', game_index_pos, self.n_games + 1)
+        self.header_index = self.section('<u8', header_index_pos, self.n_games + 1)
+
+    def section(self, dtype, pos, size):
+        if size == 0:
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(self.fn, dtype=dtype, mode='r', offset=pos, shape=(size,))
+
+    def __len__(self):
+        return self.n_games
+
+    def game_moves(self, i):
+        return self.moves[self.game_index[i]:self.game_index[i + 1]]
+
+    def game_headers(self, i):
+        return decode_headers(self.headers_blob[self.header_index[i]:self.header_index[i + 1]].tobytes())
+
+
+class PgnBinWriter:
+    """
+    Write a binary archive. Moves are streamed to the output, the header
+    blob goes to a temp file and is copied after the moves at close().
+    """
+    def __init__(self, fn):
+        self.fn = fn
+        self.f = open(fn, 'wb')
+        self.f.write(b'\x00' * FILE_HEADER.size)
+        self.headers = tempfile.TemporaryFile(dir=os.path.dirname(os.path.abspath(fn)))
+        self.game_index = array('Q', [0])
+        self.header_index = array('Q', [0])
+        self.n_moves = 0
+        self.headers_size = 0
+
+    def add_moves(self, moves):
+        """
+        Add the moves of one or more games, moves is a uint16 numpy array.
+        """
+        self.f.write(moves.astype('<u2', copy=False).tobytes())
+        self.n_moves += len(moves)
+
+    def add_game(self, headers, num_moves):
+        """
+        Close a game whose num_moves moves were already given to add_moves().
+        """
+        blob = encode_headers(headers)
+        self.headers.write(blob)
+        self.headers_size += len(blob)
+        self.game_index.append(self.game_index[-1] + num_moves)
+        self.header_index.append(self.headers_size)
+
+    def pad(self):
+        self.f.write(b'\x00' * (-self.f.tell() % 8))
+
+    def close(self):
+        n_games = len(self.game_index) - 1
+        if self.game_index[-1] != self.n_moves:
+            raise ValueError(f'{self.n_moves} moves written but games have {self.game_index[-1]}')
+
+        self.pad()
+        headers_pos = self.f.tell()
+        self.headers.seek(0)
+        shutil.copyfileobj(self.headers, self.f)
+        self.headers.close()
+
+        self.pad()
+        game_index_pos = self.f.tell()
+        self.f.write(np.frombuffer(self.game_index, dtype=np.uint64).astype('<u8').tobytes())
+        header_index_pos = self.f.tell()
+        self.f.write(np.frombuffer(self.header_index, dtype=np.uint64).astype('<u8').tobytes())
+
+        self.f.seek(0)
+        self.f.write(FILE_HEADER.pack(MAGIC, FORMAT_VERSION, 0, n_games, self.n_moves,
+                                      FILE_HEADER.size, headers_pos, self.headers_size,
+                                      game_index_pos, header_index_pos))
+        self.f.close()
+
+        return n_games
+
+
+def encode_move(move):
+    return move.from_square | move.to_square << 6 | (move.promotion or 0) << 12
+
+
+def decode_moves(codes):
+    """
+    Returns a list of chess.Move from a uint16 array, a null move is 0.
+    """
+    codes = codes.astype(np.int64)
+    from_sq = (codes & 63).tolist()
+    to_sq = (codes >> 6 & 63).tolist()
+    promo = (codes >> 12 & 7).tolist()
+
+    return [chess.Move(f, t, p or None) for f, t, p in zip(from_sq, to_sq, promo)]
+
+
+def encode_headers(headers):
+    """
+    Header bytes that are not utf-8, read with surrogateescape, are saved
+    as they are.
+    """
+    return ''.join(f'{k}\x00{v}\x00' for k, v in headers.items()).encode('utf-8', 'surrogateescape')
+
+
+def decode_headers(blob):
+    items = blob.decode('utf-8', 'surrogateescape').split('\x00')
+    return dict(zip(items[0:-1:2], items[1::2]))
+
+
+def flip_moves(moves):
+    """
+    Returns the mirrored moves. The square bits of every move except the
+    null move are flipped in one numpy operation.
+    """
+    return np.where(moves != 0, moves ^ np.uint16(FLIP_MASK), moves).astype(np.uint16)
+
+
+def flip_headers(headers, fen_cache):
+    """
+    Returns the headers of the flipped game, players and results are swapped
+    as in flip_pgn and the start position is mirrored.
+    """
+    fheaders = {}
+    for k, v in headers.items():
+        if k not in tags_to_swap:
+            fheaders[k] = v
+
+    fheaders['White'] = headers.get('Black', '?')
+    fheaders['Black'] = headers.get('White', '?')
+    fheaders['Result'] = {'1-0': '0-1', '0-1': '1-0'}.get(headers.get('Result', '*'),
+                                                        headers.get('Result', '*'))
+    fheaders['WhiteElo'] = headers.get('BlackElo', '?')
+    fheaders['BlackElo'] = headers.get('WhiteElo', '?')
+    fheaders['WhiteFideId'] = headers.get('BlackFideId', '?')
+    fheaders['BlackFideId'] = headers.get('WhiteFideId', '?')
+    fheaders['WhiteTitle'] = headers.get('BlackTitle', '?')
+    fheaders['BlackTitle'] = headers.get('WhiteTitle', '?')
+
+    # The mirror of the start position has the other side to move.
+    fen = headers.get('FEN', chess.STARTING_FEN)
+    if fen not in fen_cache:
+        game = chess.pgn.Game(headers)
+        fen_cache[fen] = game.board().mirror().fen()
+    ffen = fen_cache[fen]
+
+    fheaders.pop('FEN', None)
+    fheaders.pop('SetUp', None)
+    if ffen != chess.STARTING_FEN:
+        fheaders['SetUp'] = '1'
+        fheaders['FEN'] = ffen
+
+    return fheaders
+
+
+def pgn_to_bin(pgninfn, binoutfn, flip, quarantine):
+    """
+    Save the games of a pgn file in a binary archive. Returns the number of
+    games saved.
+    """
+    writer = PgnBinWriter(binoutfn)
+    fen_cache = {}
+    batch = array('H')
+    cnt = 0
+
+    try:
+        # tell() is the byte offset of a game with the utf-8 codec.
+        with open(pgninfn, encoding='utf-8', errors='surrogateescape') as pgn:
+            while True:
+                start = pgn.tell()
+                visitor = chess.pgn.read_game(pgn, Visitor=MovesVisitor)
+                if visitor is None:
+                    break
+
+                cnt += 1
+
+                try:
+                    if visitor.error is not None:
+                        raise visitor.error
+                    headers = visitor.headers
+                    if flip:
+                        headers = flip_headers(headers, fen_cache)
+                except Exception as e:
+                    quarantine.add(cnt, start, pgn.tell(), e)
+                    continue
+
+                batch.extend(visitor.moves)
+                writer.add_game(headers, len(visitor.moves))
+
+                if len(batch) >= MOVES_BATCH_SIZE:
+                    write_batch(writer, batch, flip)
+                    batch = array('H')
+    finally:
+        write_batch(writer, batch, flip)
+        n_games = writer.close()
+
+    return n_games
+
+
+def write_batch(writer, batch, flip):
+    moves = np.frombuffer(batch, dtype=np.uint16)
+    if flip:
+        moves = flip_moves(moves)
+    writer.add_moves(moves)
+
+
+def bin_to_bin(bininfn, binoutfn, flip):
+    """
+    Copy a binary archive, flipped if flip is set. Moves are done in
+    batches of MOVES_BATCH_SIZE on the memory mapped array.
+    """
+    archive = PgnBin(bininfn)
+    writer = PgnBinWriter(binoutfn)
+    fen_cache = {}
+
+    for pos in range(0, archive.n_moves, MOVES_BATCH_SIZE):
+        moves = archive.moves[pos:pos + MOVES_BATCH_SIZE]
+        writer.add_moves(flip_moves(moves) if flip else moves)
+
+    for i in range(len(archive)):
+        headers = archive.game_headers(i)
+        if flip:
+            headers = flip_headers(headers, fen_cache)
+        writer.add_game(headers, int(archive.game_index[i + 1] - archive.game_index[i]))
+
+    return writer.close()
+
+
+def games_to_pgn(bininfn, start, end, flip):
+    """
+    Returns the pgn text of games start to end - 1 of the archive. This
+    runs in a worker process, the archive is opened again to map it.
+    """
+    archive = PgnBin(bininfn)
+    fen_cache = {}
+    texts = []
+
+    for i in range(start, end):
+        headers = archive.game_headers(i)
+        moves = archive.game_moves(i)
+        if flip:
+            headers = flip_headers(headers, fen_cache)
+            moves = flip_moves(moves)
+
+        game = chess.pgn.Game(headers)
+        game.add_line(decode_moves(moves))
+        texts.append(f'{game}\n\n')
+
+    return ''.join(texts)
+
+
+def bin_to_pgn(bininfn, pgnoutfn, flip, workers=1):
+    """
+    Write the games of a binary archive to a pgn file. Blocks of
+    GAMES_PER_TASK games are done in a pool of worker processes and written
+    in order.
+    """
+    n_games = len(PgnBin(bininfn))
+    tasks = [(start, min(start + GAMES_PER_TASK, n_games))
+             for start in range(0, n_games, GAMES_PER_TASK)]
+
+    with open(pgnoutfn, 'w', encoding='utf-8', errors='surrogateescape') as w:
+        if workers <= 1:
+            for start, end in tasks:
+                w.write(games_to_pgn(bininfn, start, end, flip))
+            return n_games
+
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            # A window of pending tasks keeps the finished texts in memory bounded.
+            pending = []
+            for start, end in tasks:
+                pending.append(pool.submit(games_to_pgn, bininfn, start, end, flip))
+                if len(pending) >= 2 * workers:
+                    w.write(pending.pop(0).result())
+            for future in pending:
+                w.write(future.result())
+
+    return n_games
+
+
+def is_bin(fn):
+    return os.path.splitext(fn)[1].lower() == BIN_EXT
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog='%s %s' % (__script_name__, __version__),
+        description=__goal__, epilog='%(prog)s')
+    parser.add_argument('--input', required=True,
+                        help=f'Input pgn or {BIN_EXT} filename (required).')
+    parser.add_argument('--output', required=False,
+                        help=f'Output filename (not required), it is a binary archive if it ends with {BIN_EXT} '
+                             'and a pgn file otherwise. If not specified a pgn input is written in '
+                             f'<input>{BIN_EXT} and an archive input in out_<input>.pgn.')
+    parser.add_argument('--flip', action='store_true',
+                        help='Flip the board and the moves and swap the player tags, same as flippgn.')
+    parser.add_argument('--workers', required=False, type=int, default=1,
+                        help='Number of processes that write the pgn from an archive, default=1.')
+    parser.add_argument('--max-errors', required=False, type=int,
+                        help='Stop when more than this number of games fail, default is no limit. '
+                             'Games that fail are saved in quarantine_<input> with a log.')
+    parser.add_argument('-v', '--version', action='version',
+                        version=f'{__version__}')
+
+    args = parser.parse_args()
+
+    start_time = time.perf_counter()
+
+    infn = args.input
+    outfn = args.output
+    stem = os.path.splitext(infn)[0]
+    if outfn is None:
+        outfn = f'out_{os.path.basename(stem)}.pgn' if is_bin(infn) else f'{stem}{BIN_EXT}'
+
+    if os.path.abspath(infn) == os.path.abspath(outfn):
+        parser.error('--output is the same file as --input.')
+
+    if is_bin(infn):
+        if is_bin(outfn):
+            n_games = bin_to_bin(infn, outfn, args.flip)
+        else:
+            n_games = bin_to_pgn(infn, outfn, args.flip, args.workers)
+    else:
+        if not is_bin(outfn):
+            parser.error(f'--output must end with {BIN_EXT} when --input is a pgn file.')
+
+        quarantine = Quarantine(infn, f'quarantine_{os.path.basename(infn)}', args.max_errors)
+        try:
+            n_games = pgn_to_bin(infn, outfn, args.flip, quarantine)
+        except TooManyErrors as e:
+            print(f'Aborted {infn}: {e}')
+            n_games = len(PgnBin(outfn))
+        quarantine.close()
+
+    print(f'Games: {n_games}, {infn}: {os.path.getsize(infn)} bytes, {outfn}: {os.path.getsize(outfn)} bytes')
+    print(f'Done {infn}, Elapse (sec): {time.perf_counter() - start_time:0.3f}')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,534 @@
+"""
+pgn_common.py
+
+Code shared by the scripts. It is not run by itself, a script imports
+it with:
+
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'pgncommon'))
+    from pgn_common import SeenGames
+
+The tests use a stub uci engine and run with:
+
+    python -m unittest discover scripts/pgncommon
+
+
+Requirements:
+  python-chess==1.2.0
+"""
+
+
+import asyncio
+import glob
+import hashlib
+import os
+import re
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import chess.engine
+import chess.polyglot
+
+
+ENGINE_DEPTH = 12  # Default search depth of --engine.
+MATE_SCORE = 32000  # Centipawn score of a mate, as in the pgn comment parsers.
+
+
+class SeenGames:
+    """
+    Set of game fingerprints with the number of the game where each was
+    first seen. It is kept in a dict, or in a sqlite file if db is given
+    so memory stays bounded on very large archives.
+    """
+    def __init__(self, db=None):
+        self.con = None
+        self.seen = {}
+        self.pending = 0
+
+        if db is not None:
+            self.con = sqlite3.connect(db)
+            self.con.execute('DROP TABLE IF EXISTS seen')
+            self.con.execute('CREATE TABLE seen (hash INTEGER PRIMARY KEY, game INTEGER)')
+
+    def add(self, fingerprint, game_num):
+        """
+        Returns the game number of the first game with this fingerprint,
+        or None if it is new.
+        """
+        if self.con is None:
+            first = self.seen.setdefault(fingerprint, game_num)
+            return None if first == game_num else first
+
+        cur = self.con.execute('INSERT OR IGNORE INTO seen VALUES (?, ?)', (fingerprint, game_num))
+        if cur.rowcount:
+            self.pending += 1
+            if self.pending >= 10000:
+                self.con.commit()
+                self.pending = 0
+            return None
+
+        return self.con.execute('SELECT game FROM seen WHERE hash = ?', (fingerprint,)).fetchone()[0]
+
+    def close(self):
+        if self.con is not None:
+            self.con.commit()
+            self.con.close()
+
+
+def game_fingerprint(moves, headers, tags=()):
+    """
+    Returns a 64-bit signed int hash of the start position, the mainline
+    moves in uci and the values of the given header tags. Bytes that are
+    not utf-8, read with errors='surrogateescape', are hashed as they are.
+    """
+    h = hashlib.blake2b(digest_size=8)
+    h.update(headers.get('FEN', '').encode())
+    for tag in tags:
+        h.update(f'|{headers.get(tag, "")}'.encode('utf-8', 'surrogateescape'))
+    h.update(b'|')
+    h.update(' '.join(moves).encode())
+
+    return int.from_bytes(h.digest(), 'big', signed=True)
+
+
+def signed_key(key):
+    """
+    Zobrist hash as a signed 64-bit int for sqlite.
+    """
+    return key - (1 << 64) if key >= (1 << 63) else key
+
+
+def spov_score(wpov_score, stm):
+    return wpov_score if stm else -wpov_score
+
+
+def parse_comment(comment, fmt, turn, spov=True):
+    """
+    Returns (eval, depth) from a move comment with eval in SPOV of the side
+    that made the move in pawn unit, depth is None if not known. Returns
+    None if the comment has no eval.
+
+    turn is the side that made the move, spov is False if cutechess style
+    scores are in wpov.
+    """
+    try:
+        if fmt == 'tcec':
+            # d=30, sd=50, mt=12345, ..., wv=0.35, ...
+            if 'wv=' not in comment:
+                return None
+            value = comment.split('wv=')[1].split(',')[0]
+            depth = int(comment.split('d=')[1].split(',')[0])
+            if 'M' in value:
+                move_eval = chess.engine.Mate(int(value.split('M')[1])).score(mate_score=MATE_SCORE) / 100
+            else:
+                move_eval = float(value)
+            return spov_score(move_eval, turn), depth
+
+        if fmt in ('lichess', 'chessbase'):
+            # [%eval -1.49], [%eval #2] or chessbase [%eval 8,38] in cp, all in wpov.
+            if '[%eval ' not in comment:
+                return None
+            split_eval = comment.split('%eval ')[1].split(']')[0].split()[0]
+            if fmt == 'chessbase':
+                cp, _, depth = split_eval.partition(',')
+                return spov_score(int(cp) / 100, turn), int(depth) if depth else None
+            if '#' in split_eval:
+                move_eval = chess.engine.Mate(int(split_eval.split('#')[1])).score(mate_score=MATE_SCORE) / 100
+            else:
+                move_eval = float(split_eval)
+            return spov_score(move_eval, turn), None
+
+        # Cutechess, winboard, shredder: +0.35/20 0.5s or +M5/30
+        first = comment.split()[0] if comment.strip() else ''
+        if '/' not in first:
+            return None
+        value, depth = first.split('/')[0:2]
+        if 'M' in value:
+            move_eval = chess.engine.Mate(int(value.split('M')[1])).score(mate_score=MATE_SCORE) / 100
+            move_eval = -move_eval if value.startswith('-') else move_eval
+        else:
+            move_eval = float(value)
+        if not spov:
+            move_eval = spov_score(move_eval, turn)
+        return move_eval, int(depth)
+    except (IndexError, ValueError):
+        return None
+
+
+class EngineAnalyzer:
+    """
+    Analyse positions with a pool of local uci engines.
+
+    Scores are cached in sqlite keyed by the position zobrist hash, the
+    engine name and the search limit. With a cache file, positions seen in
+    earlier runs or in other games are not analysed again by the same
+    engine.
+    """
+    def __init__(self, engine_path, workers=1, depth=None, nodes=None, cache=None):
+        if depth is None and nodes is None:
+            depth = ENGINE_DEPTH
+
+        self.limit = chess.engine.Limit(depth=depth, nodes=nodes)
+
+        self.con = sqlite3.connect(cache or ':memory:')
+        self.con.execute('CREATE TABLE IF NOT EXISTS cache (key INTEGER, lim TEXT, score INTEGER,'
+                         ' PRIMARY KEY (key, lim)) WITHOUT ROWID')
+
+        self.loop = asyncio.new_event_loop()
+        self.engines = self.loop.run_until_complete(self.open(engine_path, workers))
+
+        # The lim column has the engine too, scores of another engine or
+        # another limit are never read back.
+        name = self.engines[0].id.get('name', str(engine_path))
+        self.limit_key = f'{name};depth={depth},nodes={nodes}'
+
+    async def open(self, engine_path, workers):
+        engines = []
+        for _ in range(workers):
+            _, engine = await chess.engine.popen_uci(engine_path)
+            engines.append(engine)
+        return engines
+
+    async def analyse_all(self, boards):
+        queue = asyncio.Queue()
+        for key, board in boards.items():
+            queue.put_nowait((key, board))
+
+        scores = {}
+
+        async def worker(engine):
+            while not queue.empty():
+                key, board = queue.get_nowait()
+                info = await engine.analyse(board, self.limit)
+                scores[key] = info['score'].relative.score(mate_score=MATE_SCORE)
+
+        await asyncio.gather(*(worker(e) for e in self.engines))
+        return scores
+
+    def scores(self, boards):
+        """
+        Returns {key: score} in cp from the side to move for the boards
+        given as {key: board}, from the cache or else from the engines.
+        """
+        scores = {}
+        keys = list(boards)
+        for i in range(0, len(keys), 500):
+            chunk = keys[i:i + 500]
+            rows = self.con.execute(
+                f'SELECT key, score FROM cache WHERE lim = ? AND key IN ({",".join("?" * len(chunk))})',
+                [self.limit_key] + chunk).fetchall()
+            scores.update(rows)
+
+        todo = {k: b for k, b in boards.items() if k not in scores}
+        if todo:
+            new = self.loop.run_until_complete(self.analyse_all(todo))
+            with self.con:
+                self.con.executemany('INSERT OR REPLACE INTO cache VALUES (?, ?, ?)',
+                                     [(k, self.limit_key, v) for k, v in new.items()])
+            scores.update(new)
+
+        return scores
+
+    def move_evals(self, boards):
+        """
+        Returns {ply: eval} in pawn unit from the side that made the move,
+        for the positions after the move given as {ply: board}.
+        """
+        keys = {}
+        evals = {}
+        for ply, board in boards.items():
+            outcome = board.outcome()
+            if outcome is not None:
+                # The side that made the move has mated or it is a draw.
+                evals[ply] = MATE_SCORE / 100 if outcome.winner is not None else 0.0
+            else:
+                keys[ply] = signed_key(chess.polyglot.zobrist_hash(board))
+
+        scores = self.scores({key: boards[ply] for ply, key in keys.items()})
+
+        # Score is from the side to move after the move.
+        for ply, key in keys.items():
+            evals[ply] = -scores[key] / 100
+
+        return evals
+
+    def close(self):
+        for engine in self.engines:
+            self.loop.run_until_complete(engine.quit())
+        self.loop.close()
+        self.con.close()
+
+
+class TooManyErrors(Exception):
+    pass
+
+
+class Quarantine:
+    """
+    Games that fail are copied as they are from input_pgn to output and
+    the game number, byte offset and error are logged next to it.
+    """
+    def __init__(self, input_pgn, output, max_errors=None):
+        self.input_pgn = input_pgn
+        self.output = output
+        self.log_fn = f'{os.path.splitext(output)[0]}.log'
+        self.max_errors = max_errors
+        self.errors = 0
+
+    def add(self, game_num, start, end, error):
+        """
+        Save the game between byte offsets start and end. Raises
+        TooManyErrors when there are more than max_errors errors.
+        """
+        with open(self.input_pgn, 'rb') as raw:
+            raw.seek(start)
+            text = raw.read(end - start)
+        offset = start + len(text) - len(text.lstrip())
+
+        mode = 'a' if self.errors else 'w'
+        with open(self.output, mode + 'b') as f:
+            f.write(text.strip() + b'\n\n')
+        with open(self.log_fn, mode) as f:
+            f.write(f'game: {game_num}, offset: {offset}, error: {error!r}\n')
+
+        self.errors += 1
+        print(f'game: {game_num} at offset {offset} failed with {error!r}, saved to {self.output}')
+
+        if self.max_errors is not None and self.errors > self.max_errors:
+            raise TooManyErrors(f'{self.errors} errors, more than --max-errors {self.max_errors}')
+
+    def close(self):
+        if self.errors:
+            print(f'Errors: {self.errors}, games saved to {self.output}, log in {self.log_fn}')
+
+
+tags_to_swap = ['White', 'Black', 'Result', 'WhiteElo', 'BlackElo',
+                'WhiteFideId', 'BlackFideId', 'WhiteTitle', 'BlackTitle']
+
+
+def swap_tags(game, fgame):
+    """
+    Swap some header tags of game into its flipped game fgame, the other
+    tags are copied. FEN and SetUp of fgame are kept, they have the
+    mirrored start position.
+    """
+    fgame.headers['White'] = game.headers.get('Black', '?')
+    fgame.headers['Black'] = game.headers.get('White', '?')
+
+    if game.headers['Result'] == '1-0':
+        fgame.headers['Result'] = '0-1'
+    elif game.headers['Result'] == '0-1':
+        fgame.headers['Result'] = '1-0'
+    else:
+        fgame.headers['Result'] = game.headers.get('Result', '*')
+
+    fgame.headers['WhiteElo'] = game.headers.get('BlackElo', '?')
+    fgame.headers['BlackElo'] = game.headers.get('WhiteElo', '?')
+
+    fgame.headers['WhiteFideId'] = game.headers.get('BlackFideId', '?')
+    fgame.headers['BlackFideId'] = game.headers.get('WhiteFideId', '?')
+
+    fgame.headers['WhiteTitle'] = game.headers.get('BlackTitle', '?')
+    fgame.headers['BlackTitle'] = game.headers.get('WhiteTitle', '?')
+
+    # Update tags.
+    for k, v in game.headers.items():
+        if k in tags_to_swap or k in ('FEN', 'SetUp'):
+            continue
+        fgame.headers[k] = v
+
+    return fgame
+
+
+def expand_inputs(inputs):
+    """
+    Returns [(pgn filename, root folder)] from filenames, folders and glob
+    patterns. Folders are searched for *.pgn recursively. Root is the
+    folder of the input, or the fixed part of the pattern, shared by all
+    the inputs, so the files keep distinct paths below it.
+    """
+    files = []
+
+    for item in inputs:
+        path = Path(item)
+        if path.is_dir():
+            files += [(str(fn), item) for fn in sorted(path.rglob('*.pgn'))]
+        elif any(c in item for c in '*?['):
+            prefix = item[:min(item.index(c) for c in '*?[' if c in item)]
+            root = os.path.dirname(prefix) or '.'
+            files += [(fn, root) for fn in sorted(glob.glob(item, recursive=True)) if Path(fn).is_file()]
+        else:
+            files.append((item, str(path.parent)))
+
+    roots = {root for _, root in files}
+    if len(roots) > 1:
+        try:
+            common = os.path.commonpath([os.path.abspath(root) for root in roots])
+        except ValueError:
+            # Inputs on different drives, names may collide.
+            return files
+        files = [(fn, common) for fn, _ in files]
+
+    return files
+
+
+def output_name(prefix, input_pgn, root=None, shard=None):
+    """
+    Returns prefix and the input filename, or in a batch the input path
+    below root with the folders joined by '_'. A shard (i, N) is added
+    before the suffix.
+    """
+    if root is None:
+        name = prefix + Path(input_pgn).name
+    else:
+        name = prefix + os.path.relpath(input_pgn, root).replace(os.sep, '_')
+
+    if shard is not None:
+        stem, ext = os.path.splitext(name)
+        name = f'{stem}_shard_{shard[0]}_of_{shard[1]}{ext}'
+
+    return name
+
+
+def run_batch(files, worker, options, workers=None, report=None):
+    """
+    Run worker(filename, root, options) on the files given as
+    [(filename, root)] in a pool of worker processes. A file that fails is
+    reported and the batch continues. report is called with the
+    [(filename, root, result)] of the files done, in input order, before
+    the summary.
+    """
+    start_time = time.perf_counter()
+    results, failed = {}, []
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(worker, fn, root, options): (i, fn, root)
+                   for i, (fn, root) in enumerate(files)}
+
+        for future in as_completed(futures):
+            i, fn, root = futures[future]
+            try:
+                results[i] = (fn, root, future.result())
+            except Exception as e:
+                failed.append(fn)
+                print(f'Failed {fn}: {e!r}')
+                continue
+
+            print(f'Done {fn}')
+
+    if report is not None:
+        report([results[i] for i in sorted(results)])
+
+    print(f'Files: {len(files)}, failed: {len(failed)}')
+    for fn in failed:
+        print(f'  {fn}')
+
+    print(f'Done batch, Elapse (sec): {time.perf_counter() - start_time:0.3f}')
+
+
+def parse_shard(text):
+    """
+    Returns (i, n) from a shard like 2/8, shards are numbered from 1.
+    """
+    try:
+        i, n = (int(v) for v in text.split('/'))
+    except ValueError:
+        raise ValueError(f'Invalid shard {text!r}, use i/N like 2/8.') from None
+    if not 1 <= i <= n:
+        raise ValueError(f'Invalid shard {text!r}, i must be from 1 to N.')
+
+    return i, n
+
+
+def check_partials(parts, script):
+    """
+    Raise ValueError if the [(filename, partial)] are not all the shards
+    of one run of script, each given once.
+    """
+    fn0, first = parts[0]
+
+    for fn, p in parts:
+        if p.get('script') != script:
+            raise ValueError(f'{fn} is not an {script} partial file.')
+        for k in ('input', 'input_size', 'shards', 'settings'):
+            if p[k] != first[k]:
+                raise ValueError(f'{fn} and {fn0} have a different {k}.')
+
+    found = {}
+    for fn, p in parts:
+        if p['shard'] in found:
+            raise ValueError(f'Shard {p["shard"]} is in both {found[p["shard"]]} and {fn}.')
+        found[p['shard']] = fn
+
+    missing = sorted(set(range(1, first['shards'] + 1)) - set(found))
+    if missing:
+        raise ValueError(f'Missing shard {", ".join(map(str, missing))} of {first["shards"]}.')
+
+
+WHERE_TERM = re.compile(r'^\s*(\w+)\s*(>=|<=|!=|!~|=|~|>|<)\s*(.*?)\s*$')
+# An 'and' followed by an even number of quotes is outside a quoted value.
+WHERE_AND = re.compile(r'\s+and\s+(?=(?:[^"]*"[^"]*")*[^"]*$)', re.IGNORECASE)
+
+
+def parse_where(expr):
+    """
+    Parse a header filter expression into a list of (tag, op, value).
+
+    Terms are joined with 'and', example:
+      White~Stockfish and Result=1-0 and Date>=2023.01.01
+
+    A value in double quotes may contain ' and ', as in Event~"Rock and Roll".
+
+    = and != are exact matches, ~ and !~ are case insensitive substring
+    matches, <, <=, > and >= compare numerically if both sides are numbers
+    otherwise as strings, so PGN dates compare correctly.
+    """
+    clauses = []
+
+    if expr is None or expr.strip() == '':
+        return clauses
+
+    for term in WHERE_AND.split(expr.strip()):
+        m = WHERE_TERM.match(term)
+        if m is None:
+            raise ValueError(f'Invalid where term: {term!r}')
+        tag, op, value = m.groups()
+        clauses.append((tag, op, value.strip('"')))
+
+    return clauses
+
+
+def match_where(headers, clauses):
+    """
+    Returns True if the game headers satisfy all clauses from parse_where().
+    """
+    for tag, op, value in clauses:
+        field = headers.get(tag, '')
+
+        if op == '=':
+            ok = field == value
+        elif op == '!=':
+            ok = field != value
+        elif op == '~':
+            ok = value.lower() in field.lower()
+        elif op == '!~':
+            ok = value.lower() not in field.lower()
+        else:
+            try:
+                a, b = float(field), float(value)
+            except ValueError:
+                a, b = field, value
+            if op == '>=':
+                ok = a >= b
+            elif op == '<=':
+                ok = a <= b
+            elif op == '>':
+                ok = a > b
+            else:
+                ok = a < b
+
+        if not ok:
+            return False
+
+    return True
@@ -0,0 +1,59 @@
+"""
+pgn_series.py
+
+Compact per game eval and time series, shared by evalswing and pgngraph.
+It is in its own module as it needs numpy.
+
+
+Requirements:
+  numpy
+"""
+
+
+import sys
+from array import array
+
+import numpy as np
+
+
+class GameSeries:
+    """
+    Compact eval and time series of one game.
+
+    Evals are in SPOV of each side in pawn unit and times are in sec. The
+    series are kept in array('f') with nan for a missing value instead of
+    lists of boxed floats, header fields are interned as player and event
+    names repeat across games.
+    """
+    __slots__ = ('num', 'white', 'black', 'result', 'event', 'date', 'round',
+                 'start_ply', 'move_num', 'w_eval', 'b_eval', 'w_time', 'b_time')
+
+    def __init__(self, num, headers, start_ply=0):
+        self.num = num
+        self.white = sys.intern(headers.get('White', '?'))
+        self.black = sys.intern(headers.get('Black', '?'))
+        self.result = sys.intern(headers.get('Result', '*'))
+        self.event = sys.intern(headers.get('Event', '?'))
+        self.date = sys.intern(headers.get('Date', '?'))
+        self.round = sys.intern(headers.get('Round', '?'))
+        self.start_ply = start_ply
+        self.move_num = array('H')
+        self.w_eval = array('f')
+        self.b_eval = array('f')
+        self.w_time = array('f')
+        self.b_time = array('f')
+
+    def wpov_evals(self):
+        """
+        Returns the evals per ply in WPOV as a float32 numpy array.
+        """
+        w = np.frombuffer(self.w_eval, dtype=np.float32)
+        b = -np.frombuffer(self.b_eval, dtype=np.float32)
+        out = np.empty(len(w) + len(b), dtype=np.float32)
+
+        if self.start_ply % 2 == 0:
+            out[0::2], out[1::2] = w, b
+        else:
+            out[0::2], out[1::2] = b, w
+
+        return out
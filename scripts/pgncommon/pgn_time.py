@@ -0,0 +1,126 @@
+"""
+pgn_time.py
+
+Time spent per move read from the pgn move comments, shared by evalswing
+and pgngraph. It is in its own module as it needs numpy.
+
+
+Requirements:
+  numpy
+"""
+
+
+from array import array
+
+import numpy as np
+
+
+NAN = float('nan')
+
+
+def get_time(comment, tcec=False, lichess=False):
+    """
+    Brackets are not included when reading comment below.
+
+    {+13.30/12 0.020s}
+    {0}
+    {0.001}
+    {0.002}
+    { [%eval -1.49] [%clk 0:15:10] }, from lichess, wpov_score
+
+    Lichess has the clock remaining and not the time spent on the move,
+    the clock is returned here, see clock_to_movetime().
+
+    A book move or a move without comment has no time, nan is returned.
+    """
+    if lichess:
+        return get_clock(comment)
+
+    if 'book' in comment.lower():
+        return NAN
+
+    if comment == '':
+        return NAN
+
+    elapse_sec = 0.0
+
+    # If pgn file is from TCEC, mt is in ms.
+    if tcec:
+        elapse_sec = int(comment.split('mt=')[1].split(',')[0])
+        elapse_sec = elapse_sec / 1000
+
+    # Cutechess, winboard
+    else:
+        # One part split, {0} or {0.001}, assume it is time.
+        if len(comment.split()) == 1:
+            value = comment.split('s')[0]
+            try:
+                elapse_sec = float(value)
+            except ValueError:
+                # +1.02/25
+                pass  # returns 0.0
+        # Two or more parts split, {+13.30/12 0.020s} or {+13.30/12 0.020s xboard}
+        elif len(comment.split()) > 1:
+            # Take the 2nd part
+            time_comment = comment.split()[1].strip()
+
+            # {+1000.01/127 Xboard adjudication: Checkmate} by winboard
+            if any(s in time_comment.lower() for s in ['adjudication', 'xboard', 'claim', 'draw', 'repetition']):
+                elapse_sec = 0
+            else:
+                # Ignore hr for now, 2:22, that is min:sec
+                if ':' in time_comment:
+                    elapse_sec = int(time_comment.split(':')[1])
+                    elapse_min = int(time_comment.split(':')[0])
+                    elapse_sec = elapse_sec + 60 * elapse_min
+                else:
+                    split_time = comment.split()[1].split('s')[0]  # remove s if there is
+                    try:
+                        elapse_sec = float(split_time)
+                    # +0.00/1 Draw by repetition
+                    except ValueError:
+                        elapse_sec = 0
+
+    return elapse_sec
+
+def get_clock(comment):
+    """
+    Returns the clock remaining in sec from [%clk h:mm:ss] or nan.
+    """
+    if '%clk' not in comment:
+        return NAN
+
+    # [%eval -1.49] [%clk 0:15:10]
+    split_time = comment.split('%clk')[1].split(']')[0].strip()  # 0:15:10
+    elapse_hr, elapse_min, elapse_sec = split_time.split(':')
+
+    return float(elapse_sec) + 60*int(elapse_min) + 60*60*int(elapse_hr)
+
+
+def time_control(tc):
+    """
+    Returns (base, increment) in sec of the first period of a TimeControl
+    header like 180+2, 40/7200:3600 or 60, base is nan if unknown.
+    """
+    period = tc.split(':')[0].split('/')[-1]
+    base, _, inc = period.partition('+')
+
+    try:
+        return float(base), float(inc or 0)
+    except ValueError:
+        return NAN, 0.0
+
+
+def clock_to_movetime(clock, base, inc):
+    """
+    Returns the time spent per move from the clock remaining after each
+    move of one side, spent = previous clock - clock + increment.
+    """
+    clk = np.frombuffer(clock, dtype=np.float32)
+    prev = np.concatenate([[base], clk])[:len(clk)]
+    spent = prev - clk + inc
+
+    # A new period adds time to the clock, the time spent is not known.
+    spent[spent < 0] = np.nan
+
+    return array('f', spent.astype(np.float32).tobytes())
@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+
+
+"""
+stub_engine.py
+
+Minimal uci engine for the tests. It answers every search with the same
+score and the first legal move, and appends the fen of each searched
+position to a log file.
+
+
+Usage:
+    python stub_engine.py <name> <score cp> <log file>
+"""
+
+
+import sys
+
+import chess
+
+
+def main():
+    name, score, log_fn = sys.argv[1], int(sys.argv[2]), sys.argv[3]
+    board = chess.Board()
+
+    for line in sys.stdin:
+        tokens = line.split()
+        if not tokens:
+            continue
+
+        cmd = tokens[0]
+        if cmd == 'uci':
+            print(f'id name {name}')
+            print('uciok')
+        elif cmd == 'isready':
+            print('readyok')
+        elif cmd == 'position':
+            moves = tokens.index('moves') if 'moves' in tokens else len(tokens)
+            fen = ' '.join(tokens[2:moves]) if tokens[1] == 'fen' else chess.STARTING_FEN
+            board = chess.Board(fen)
+            for uci in tokens[moves + 1:]:
+                board.push_uci(uci)
+        elif cmd == 'go':
+            with open(log_fn, 'a') as f:
+                f.write(board.fen() + '\n')
+            print(f'info depth 1 score cp {score}')
+            print(f'bestmove {next(iter(board.legal_moves)).uci()}')
+        elif cmd == 'quit':
+            break
+
+        sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
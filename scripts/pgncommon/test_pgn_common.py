@@ -0,0 +1,111 @@
+"""
+Tests of EngineAnalyzer with the stub uci engine.
+"""
+
+
+import os
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+import chess
+import chess.polyglot
+
+from pgn_common import EngineAnalyzer, MATE_SCORE, signed_key
+
+
+STUB_ENGINE = str(Path(__file__).resolve().parent / 'stub_engine.py')
+
+
+class EngineAnalyzerTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cache = os.path.join(self.tmp.name, 'cache.sqlite')
+        self.log = os.path.join(self.tmp.name, 'searches.log')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def analyzer(self, name, score):
+        return EngineAnalyzer([sys.executable, STUB_ENGINE, name, str(score), self.log],
+                              depth=1, cache=self.cache)
+
+    def searches(self):
+        if not os.path.exists(self.log):
+            return 0
+        with open(self.log) as f:
+            return len(f.readlines())
+
+    def test_mate_is_good_for_the_side_that_moved(self):
+        board = chess.Board()
+        for san in ['f3', 'e5', 'g4', 'Qh4#']:
+            board.push_san(san)
+
+        analyzer = self.analyzer('Stub', 50)
+        try:
+            evals = analyzer.move_evals({3: board})
+        finally:
+            analyzer.close()
+
+        self.assertEqual(evals, {3: MATE_SCORE / 100})
+        self.assertEqual(self.searches(), 0)
+
+    def test_stalemate_is_a_draw(self):
+        board = chess.Board('7k/5Q2/6K1/8/8/8/8/8 b - - 0 1')
+        self.assertTrue(board.is_stalemate())
+
+        analyzer = self.analyzer('Stub', 50)
+        try:
+            evals = analyzer.move_evals({0: board})
+        finally:
+            analyzer.close()
+
+        self.assertEqual(evals, {0: 0.0})
+
+    def test_score_is_from_the_side_that_moved(self):
+        board = chess.Board()
+        board.push_san('e4')
+
+        analyzer = self.analyzer('Stub', 50)
+        try:
+            evals = analyzer.move_evals({0: board})
+        finally:
+            analyzer.close()
+
+        self.assertEqual(evals, {0: -0.5})
+
+    def test_cache_hits(self):
+        board = chess.Board()
+        board.push_san('e4')
+        boards = {signed_key(chess.polyglot.zobrist_hash(board)): board}
+
+        analyzer = self.analyzer('Stub', 50)
+        try:
+            first = analyzer.scores(boards)
+            second = analyzer.scores(boards)
+        finally:
+            analyzer.close()
+
+        self.assertEqual(first, second)
+        self.assertEqual(self.searches(), 1)
+
+        # Same engine in a later run reads the cache file.
+        analyzer = self.analyzer('Stub', 50)
+        try:
+            self.assertEqual(analyzer.scores(boards), first)
+        finally:
+            analyzer.close()
+        self.assertEqual(self.searches(), 1)
+
+        # Another engine does not get the scores of the first one.
+        analyzer = self.analyzer('Other stub', -30)
+        try:
+            self.assertEqual(list(analyzer.scores(boards).values()), [-30])
+        finally:
+            analyzer.close()
+        self.assertEqual(self.searches(), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
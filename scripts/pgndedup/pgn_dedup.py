@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+
+
+"""
+pgn_dedup.py
+
+Remove duplicate games from a pgn file.
+
+A game is a duplicate if its start position and mainline moves, and
+optionally some header values, are the same as an earlier game.
+
+
+Setup:
+  Install python 3.8 or newer
+
+
+Requirements:
+  python-chess==1.2.0
+
+
+Usage:
+    python pgn_dedup.py --input broadcast.pgn
+    python pgn_dedup.py --input broadcast.pgn --headers White,Black --db seen.sqlite
+"""
+
+
+__version__ = 'v0.2.0'
+__script_name__ = 'pgndedup'
+__goal__ = 'Remove duplicate games from a pgn file.'
+
+
+import argparse
+import os
+import sys
+import time
+from pathlib import Path
+
+import chess.pgn
+
+# Code shared by the scripts is in scripts/pgncommon.
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'pgncommon'))
+from pgn_common import Quarantine, SeenGames, TooManyErrors, game_fingerprint
+
+
+class MovesVisitor(chess.pgn.BaseVisitor):
+    """
+    Collect the headers and mainline moves of a game without building
+    the game tree. An illegal move is kept as the error of the game, the
+    rest of the game is still read.
+    """
+    def begin_game(self):
+        self.headers = {}
+        self.moves = []
+        self.error = None
+
+    def visit_header(self, tagname, tagvalue):
+        self.headers[tagname] = tagvalue
+
+    def begin_variation(self):
+        return chess.pgn.SKIP
+
+    def visit_move(self, board, move):
+        self.moves.append(move.uci())
+
+    def handle_error(self, error):
+        if self.error is None:
+            self.error = error
+
+    def result(self):
+        return self
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog='%s %s' % (__script_name__, __version__),
+        description=__goal__, epilog='%(prog)s')
+    parser.add_argument('--input', required=True,
+                        help='Input pgn filename (required).')
+    parser.add_argument('--output', required=False,
+                        help='Output pgn filename for unique games (not required).'
+                             ' If not specified it will be written in out_<input>.')
+    parser.add_argument('--headers', required=False, type=str, default='',
+                        help='Comma separated header tags that are also part of the'
+                             ' fingerprint, example White,Black,Event (not required).')
+    parser.add_argument('--db', required=False, type=str,
+                        help='Keep fingerprints in this sqlite file instead of memory (not required).')
+    parser.add_argument('--max-errors', required=False, type=int,
+                        help='Stop when more than this number of games fail, default is no limit. '
+                             'Games that fail are saved in quarantine_<input> with a log.')
+    parser.add_argument('-v', '--version', action='version',
+                        version=f'{__version__}')
+
+    args = parser.parse_args()
+
+    start_time = time.perf_counter()
+
+    infn = args.input
+    outfn = args.output
+    if outfn is None:
+        outfn = f'out_{infn}'
+
+    tags = [t.strip() for t in args.headers.split(',') if t.strip()]
+    seen = SeenGames(args.db)
+    cnt, dups = 0, 0
+
+    quarantine = Quarantine(infn, f'quarantine_{os.path.basename(infn)}', args.max_errors)
+
+    # Unique games are copied as they are from the input bytes. The text
+    # handle uses the utf-8 codec so that its tell() at the start of a game
+    # is the byte offset in raw, also for crlf lines. Bytes that are not
+    # utf-8, as in latin-1 files, are kept by surrogateescape.
+    try:
+        with open(infn, encoding='utf-8', errors='surrogateescape') as pgn, \
+                open(infn, 'rb') as raw, open(outfn, 'wb') as out:
+            while True:
+                offset = pgn.tell()
+                game = chess.pgn.read_game(pgn, Visitor=MovesVisitor)
+                if game is None:
+                    break
+
+                cnt += 1
+                text = raw.read(pgn.tell() - offset)
+
+                try:
+                    if game.error is not None:
+                        raise game.error
+                    first = seen.add(game_fingerprint(game.moves, game.headers, tags), cnt)
+                except Exception as e:
+                    quarantine.add(cnt, offset, offset + len(text), e)
+                    continue
+
+                if first is not None:
+                    dups += 1
+                    print(f'game: {cnt} is a duplicate of game {first}')
+                    continue
+
+                out.write(text.rstrip() + b'\n\n')
+    except TooManyErrors as e:
+        print(f'Aborted {infn}: {e}')
+
+    quarantine.close()
+    seen.close()
+
+    print(f'Games: {cnt}, duplicates: {dups}, saved {cnt - dups - quarantine.errors} games to {outfn}')
+    print(f'Done {infn}, Elapse (sec): {time.perf_counter() - start_time:0.3f}')
+
+
+if __name__ == "__main__":
+    main()
@@ -13,10 +13,19 @@ Setup:
 
 Usage:
     python pgngraph.py --input mygame.pgn
+    python pgngraph.py --input mygame.pgn --where "White~Stockfish and Result=1-0"
+    python pgngraph.py --input mygame.pgn --html
+    python pgngraph.py --input mygame.pgn --density
+    python pgngraph.py --input mygame.pgn --lichess --time-report
+    python pgngraph.py --input mygame.pgn --dedup
+    python pgngraph.py --input human_games.pgn --lichess --engine stockfish --engine-workers 4
+    python pgngraph.py --input rounds/ --output-dir plots --workers 8
+    python pgngraph.py --input archive.pgn --density --shard 1/4
+    python pgngraph.py --merge "archive_shard_*_of_4.json"
 """
 
 
-__version__ = 'v0.25.0'
+__version__ = 'v0.35.0'
 __author__ = 'fsmosca'
 __credits__ = ['rwbc']
 __script_name__ = 'pgngraph'
@@ -24,16 +33,171 @@ __goal__ = 'Read pgn file and save eval and time plot per game.'
 
 
 import argparse
+import glob
+import json
+import os
+import sys
 import time
-from typing import List, Set, Dict, Tuple, Optional
+from pathlib import Path
+from typing import Sequence
 
+import matplotlib.colors as mcolors
 import matplotlib.pyplot as plt
 import matplotlib.ticker as ticker
+import numpy as np
 import chess.pgn
 from chess.engine import Mate
 
+# Code shared by the scripts is in scripts/pgncommon.
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'pgncommon'))
+from pgn_common import (ENGINE_DEPTH, EngineAnalyzer, Quarantine, SeenGames, TooManyErrors, check_partials,
+                        expand_inputs, game_fingerprint, match_where, output_name, parse_shard, parse_where,
+                        run_batch, spov_score)
+from pgn_series import GameSeries
+from pgn_time import clock_to_movetime, get_time, time_control
+
 
 PLOT_BG_COLOR = '0.4'  # Gray shades, 0 to 1, 0 is darker.
+DENSITY_EVAL_BINS = 80  # Number of eval bins between the eval limits.
+DENSITY_MAX_ENGINES = 6  # Engines with the most moves shown in the density plot.
+DENSITY_BATCH_SIZE = 1000  # Number of games binned at once.
+TIME_PHASES = [('Opening', 1), ('Middlegame', 21), ('Endgame', 41)]  # (name, first move number)
+NAN = float('nan')
+
+# Self-contained page for --html, games and options are inlined as json
+# and the plots are drawn on canvas without any external library.
+HTML_TEMPLATE = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>__TITLE__</title>
+<style>
+body { font-family: sans-serif; font-size: 13px; margin: 12px; }
+#bar { margin-bottom: 8px; }
+#bar input { width: 4em; }
+#head { text-align: center; margin: 4px; }
+#head b { font-size: 15px; }
+canvas { display: block; margin: 4px auto; }
+</style>
+</head>
+<body>
+<div id="bar">
+Game <select id="game"></select>
+Eval <input id="mineval" type="number"> to <input id="maxeval" type="number">
+Move <input id="minmove" type="number"> to <input id="maxmove" type="number">
+</div>
+<div id="head"><b id="players"></b><br><span id="info"></span></div>
+<canvas id="eval" width="900" height="300"></canvas>
+<canvas id="time" width="900" height="300"></canvas>
+<script id="options" type="application/json">__OPTIONS__</script>
+<script id="games" type="application/json">__GAMES__</script>
+<script>
+const opt = JSON.parse(document.getElementById('options').textContent);
+const games = JSON.parse(document.getElementById('games').textContent);
+const $ = id => document.getElementById(id);
+
+function num(id) {
+  const v = parseFloat($(id).value);
+  return isNaN(v) ? null : v;
+}
+
+function niceStep(range) {
+  const raw = range / 8, p = Math.pow(10, Math.floor(Math.log10(raw)));
+  for (const m of [1, 2, 2.5, 5, 10]) { if (m * p >= raw) return m * p; }
+  return 10 * p;
+}
+
+function plot(canvas, title, ylabel, xs, lines, bg, ylo, yhi, xlo, xhi) {
+  const c = canvas.getContext('2d'), W = canvas.width, H = canvas.height;
+  const L = 60, R = 20, T = 28, B = 36, pw = W - L - R, ph = H - T - B;
+  c.clearRect(0, 0, W, H);
+  c.fillStyle = bg; c.fillRect(L, T, pw, ph);
+  if (yhi <= ylo) { yhi = ylo + 1; }
+  if (xhi <= xlo) { xhi = xlo + 1; }
+  const X = x => L + (x - xlo) / (xhi - xlo) * pw;
+  const Y = y => T + (yhi - y) / (yhi - ylo) * ph;
+  c.fillStyle = '#000'; c.font = '13px sans-serif'; c.textAlign = 'center';
+  c.fillText(title, L + pw / 2, 18);
+  c.font = '10px sans-serif'; c.strokeStyle = 'rgba(0,0,0,0.25)'; c.lineWidth = 0.5;
+  const ys = niceStep(yhi - ylo);
+  for (let y = Math.ceil(ylo / ys) * ys; y <= yhi; y += ys) {
+    c.beginPath(); c.moveTo(L, Y(y)); c.lineTo(L + pw, Y(y)); c.stroke();
+    c.textAlign = 'right'; c.fillText(+y.toFixed(2), L - 4, Y(y) + 3);
+  }
+  const xstep = Math.max(1, Math.ceil((xhi - xlo) / 20));
+  for (let x = Math.ceil(xlo); x <= xhi; x += xstep) {
+    c.beginPath(); c.moveTo(X(x), T); c.lineTo(X(x), T + ph); c.stroke();
+    c.textAlign = 'center'; c.fillText(x, X(x), T + ph + 12);
+  }
+  c.fillText('Move number', L + pw / 2, H - 6);
+  c.save(); c.translate(12, T + ph / 2); c.rotate(-Math.PI / 2); c.fillText(ylabel, 0, 0); c.restore();
+  if (ylo < 0 && yhi > 0) {
+    c.strokeStyle = 'red'; c.lineWidth = 0.5;
+    c.beginPath(); c.moveTo(L, Y(0)); c.lineTo(L + pw, Y(0)); c.stroke();
+  }
+  c.save(); c.beginPath(); c.rect(L, T, pw, ph); c.clip();
+  lines.forEach(ln => {
+    c.strokeStyle = ln.color; c.lineWidth = 1.5; c.beginPath();
+    let pen = false;
+    xs.forEach((x, i) => {
+      const y = ln.values[i];
+      if (y === null || y === undefined) { pen = false; return; }
+      if (pen) { c.lineTo(X(x), Y(y)); } else { c.moveTo(X(x), Y(y)); pen = true; }
+    });
+    c.stroke();
+  });
+  c.restore();
+  lines.forEach((ln, k) => {
+    c.fillStyle = ln.color; c.fillRect(L + 8, T + 8 + 14 * k, 16, 3);
+    c.fillStyle = '#000'; c.textAlign = 'left'; c.fillText(ln.label, L + 28, T + 12 + 14 * k);
+  });
+}
+
+function range(arrays) {
+  let lo = Infinity, hi = -Infinity;
+  arrays.forEach(a => a.forEach(v => { if (v !== null) { lo = Math.min(lo, v); hi = Math.max(hi, v); } }));
+  return lo > hi ? [0, 0] : [lo, hi];
+}
+
+function show() {
+  const g = games[$('game').selectedIndex];
+  if (!g) return;
+  $('players').textContent = g.white + ' vs ' + g.black;
+  $('info').textContent = g.event + ', ' + g.date + ', Round: ' + g.round + ', (' + g.num + '), ' + g.result;
+  const [mlo, mhi] = range([g.move]);
+  const minMove = num('minmove'), maxMove = num('maxmove');
+  const xlo = Math.max(mlo, minMove === null ? mlo - 1 : minMove - 1);
+  const xhi = Math.min(mhi, maxMove === null ? mhi + 1 : maxMove + 1);
+  const [elo, ehi] = range([g.w_eval, g.b_eval]);
+  const minEval = num('mineval'), maxEval = num('maxeval');
+  plot($('eval'), 'Evaluation', 'Score in pawn unit', g.move,
+       [{label: g.white, color: opt.white_line_color, values: g.w_eval},
+        {label: g.black, color: opt.black_line_color, values: g.b_eval}],
+       opt.plot_eval_bg_color,
+       minEval === null ? elo - 0.01 : Math.max(minEval, elo - 0.01),
+       maxEval === null ? ehi + 0.01 : Math.min(maxEval, ehi + 0.01), xlo, xhi);
+  const [tlo, thi] = range([g.w_time, g.b_time]);
+  plot($('time'), 'Elapse Time', 'movetime in sec', g.move,
+       [{label: g.white, color: opt.white_line_color, values: g.w_time},
+        {label: g.black, color: opt.black_line_color, values: g.b_time}],
+       opt.plot_time_bg_color, Math.min(0, tlo), thi * 1.05, xlo, xhi);
+}
+
+games.forEach(g => {
+  const o = document.createElement('option');
+  o.textContent = g.num + ': ' + g.white + ' vs ' + g.black + ', ' + g.result;
+  $('game').appendChild(o);
+});
+['mineval', 'maxeval', 'minmove', 'maxmove'].forEach(k => {
+  if (opt[k] !== null) $(k).value = opt[k];
+  $(k).addEventListener('change', show);
+});
+$('game').addEventListener('change', show);
+show();
+</script>
+</body>
+</html>
+"""
 
 
 class GameInfoPlotter:
@@ -45,8 +209,28 @@ class GameInfoPlotter:
                  white_line_color='white',
                  black_line_color='black',
                  min_move_limit=None,
-                 max_move_limit=None):
+                 max_move_limit=None,
+                 where=None,
+                 html=False,
+                 density=False,
+                 time_report=False,
+                 dedup=False,
+                 dedup_headers='',
+                 dedup_db=None,
+                 engine=None,
+                 engine_workers=1,
+                 engine_depth=None,
+                 engine_nodes=None,
+                 engine_cache=None,
+                 output_dir=None,
+                 input_root=None,
+                 max_errors=None,
+                 shard=None,
+                 verbose=True):
         self.input_pgn = input_pgn
+        self.output_dir = output_dir
+        self.input_root = input_root
+        self.verbose = verbose
         self.plot_file = plot_file
         self.fig_width = width
         self.fig_height = height
@@ -61,6 +245,43 @@ class GameInfoPlotter:
         self.black_line_color =black_line_color
         self.min_move_limit = min_move_limit
         self.max_move_limit = max_move_limit
+        self.where = parse_where(where)
+        self.html = html
+        self.density = density
+
+        # Density mode, per engine counts of [move number, eval bin] and
+        # the (engine, move numbers, evals) waiting to be binned.
+        self.density_counts = {}
+        self.density_batch = []
+
+        # Time report mode, per engine sum and count of time per phase.
+        self.time_report = time_report
+        self.time_sum = {}
+        self.time_count = {}
+        self.time_batch = []
+        self.seen = SeenGames(dedup_db) if dedup else None
+        self.dedup_headers = [t.strip() for t in dedup_headers.split(',') if t.strip()]
+        self.duplicates = 0
+        self.analyzer = None
+        if engine is not None:
+            self.analyzer = EngineAnalyzer(engine, workers=engine_workers, depth=engine_depth,
+                                           nodes=engine_nodes, cache=engine_cache)
+        self.max_errors = max_errors
+        self.shard = shard
+
+        if self.output_dir is not None:
+            Path(self.output_base()).parent.mkdir(parents=True, exist_ok=True)
+
+        # Settings that must be the same in all shards of a run.
+        self.settings = {'width': width, 'height': height, 'min_eval_limit': min_eval_limit,
+                         'max_eval_limit': max_eval_limit, 'dpi': dpi, 'tcec': tcec,
+                         'lichess': lichess, 'plot_eval_bg_color': plot_eval_bg_color,
+                         'plot_time_bg_color': plot_time_bg_color,
+                         'white_line_color': white_line_color, 'black_line_color': black_line_color,
+                         'min_move_limit': min_move_limit, 'max_move_limit': max_move_limit,
+                         'where': where, 'html': html, 'density': density,
+                         'time_report': time_report, 'dedup': dedup, 'dedup_headers': dedup_headers,
+                         'engine_depth': engine_depth, 'engine_nodes': engine_nodes}
 
         plt.rc('legend', **{'fontsize': 6})
 
@@ -93,8 +314,8 @@ class GameInfoPlotter:
             comment: str,
             turn: bool,
             ply: int,
-            black_eval: List[float],
-            white_eval: List[float]
+            black_eval: Sequence[float],
+            white_eval: Sequence[float]
     ) -> float:
         """
         Returns move_eval with SPOV in pawn unit.
@@ -107,7 +328,7 @@ class GameInfoPlotter:
         if comment == '':
             if ply % 2:
                 if len(black_eval):
-                    move_eval = -black_eval[-1]
+                    move_eval = black_eval[-1]
             else:
                 if len(white_eval):
                     move_eval = white_eval[-1]
@@ -156,7 +377,7 @@ class GameInfoPlotter:
                     move_eval = 0.0  # Set to zero if no history.
                     if ply % 2:
                         if len(black_eval):
-                            move_eval = -black_eval[-1]
+                            move_eval = black_eval[-1]
                     else:
                         if len(white_eval):
                             move_eval = white_eval[-1]
@@ -173,99 +394,62 @@ class GameInfoPlotter:
 
         return move_eval
 
-    def get_time(self, comment):
+    def has_eval(self, comment):
         """
-        Brackets are not included when reading comment below.
-
-        {+13.30/12 0.020s}
-        {0}
-        {0.001}
-        {0.002}
-        { [%eval -1.49] [%clk 0:15:10] }, from lichess, wpov_score
+        Returns True if the move comment has an eval in the input format.
         """
-        elapse_sec = 0.0
-
-        if 'book' in comment.lower():
-            return elapse_sec
-
-        if comment == '':
-            return elapse_sec
-
-        # If pgn file is from TCEC.
+        if comment.strip() == '' or 'book' in comment.lower():
+            return False
         if self.tcec:
-            elapse_sec = int(comment.split('mt=')[1].split(',')[0])
-            elapse_sec = elapse_sec // 1000
+            return 'wv=' in comment
+        if self.lichess:
+            return '[%eval ' in comment
+        return '/' in comment.split()[0]
 
-        elif self.lichess:
-            # h:mm:sec
-            # [%eval -1.49] [%clk 0:15:10]
-            split_time = comment.split('%clk')[1].split(']')[0].strip()  # 0:15:10
-            elapse_sec = int(split_time.split(':')[2])
-            elapse_min = int(split_time.split(':')[1])
-            elapse_hr = int(split_time.split(':')[0])
-            elapse_sec = elapse_sec + 60*elapse_min + 60*60*elapse_hr
-
-        # Cutechess, winboard
-        else:
-            # One part split, {0} or {0.001}, assume it is time.
-            if len(comment.split()) == 1:
-                value = comment.split('s')[0]
-                try:
-                    elapse_sec = float(value)
-                except ValueError:
-                    # +1.02/25
-                    pass  # returns 0.0
-            # Two or more parts split, {+13.30/12 0.020s} or {+13.30/12 0.020s xboard}
-            elif len(comment.split()) > 1:
-                # Take the 2nd part
-                time_comment = comment.split()[1].strip()
-
-                # {+1000.01/127 Xboard adjudication: Checkmate} by winboard
-                if any(s in time_comment.lower() for s in ['adjudication', 'xboard', 'claim', 'draw', 'repetition']):
-                    elapse_sec = 0
-                else:
-                    # Ignore hr for now, 2:22, that is min:sec
-                    if ':' in time_comment:
-                        elapse_sec = int(time_comment.split(':')[1])
-                        elapse_min = int(time_comment.split(':')[0])
-                        elapse_sec = elapse_sec + 60 * elapse_min
-                    else:
-                        split_time = comment.split()[1].split('s')[0]  # remove s if there is
-                        try:
-                            elapse_sec = float(split_time)
-                        # +0.00/1 Draw by repetition
-                        except ValueError:
-                            elapse_sec = 0
+    def engine_evals(self, game):
+        """
+        Returns {ply: eval} with eval in SPOV of the side that made the move
+        in pawn unit, for the moves without an eval in the comment.
+        """
+        boards = {}
+        board = game.board()
+        for node in game.mainline():
+            ply = board.ply()
+            board.push(node.move)
+            if not self.has_eval(node.comment):
+                boards[ply] = board.copy(stack=False)
 
-        return elapse_sec
+        return self.analyzer.move_evals(boards)
 
-    def plotter(self, game, outputfn, game_num):
+    def parse_game(self, game, game_num=0):
         """
-        Read game get eval in the move comment and plot it.
+        Returns the GameSeries of the game mainline with white and black
+        evals in SPOV and the elapse time of each move.
         """
-        ev = game.headers['Event']
-        da = game.headers['Date']
-        rd = game.headers['Round']
-        wp = game.headers['White']
-        bp = game.headers['Black']
-        res = game.headers['Result']
-
-        move_num, b_eval, w_eval, b_time, w_time = [], [], [], [], []
+        series = GameSeries(game_num, game.headers, game.board().ply())
+        move_num, b_eval, w_eval = series.move_num, series.b_eval, series.w_eval
+        engine_evals = {} if self.analyzer is None else self.engine_evals(game)
+        b_time, w_time = series.b_time, series.w_time
+
+        # One board is pushed along the mainline, node.board() would replay
+        # the game from the start at every move.
+        board = game.board()
         for node in game.mainline():
-            board = node.board()
-            parent_node = node.parent
-            parent_board = parent_node.board()
             comment = node.comment
-            fmvn = parent_board.fullmove_number
-            ply = parent_board.ply()
+            fmvn = board.fullmove_number
+            ply = board.ply()
+            turn = board.turn
+            board.push(node.move)
 
-            move_eval = self.get_eval(board, comment, parent_board.turn, ply, b_eval, w_eval)
-            time_elapse_sec = self.get_time(comment)
+            if ply in engine_evals:
+                move_eval = engine_evals[ply]
+            else:
+                move_eval = self.get_eval(board, comment, turn, ply, b_eval, w_eval)
+            time_elapse_sec = get_time(comment, self.tcec, self.lichess)
 
             # Black
             if ply % 2:
-                # Positive eval is good for white while negative eval is good for black.
-                b_eval.append(-move_eval)
+                b_eval.append(move_eval)
                 b_time.append(time_elapse_sec)
             else:
                 w_eval.append(move_eval)
@@ -273,6 +457,29 @@ class GameInfoPlotter:
 
                 w_time.append(time_elapse_sec)
 
+        if self.lichess:
+            base, inc = time_control(game.headers.get('TimeControl', '-'))
+            series.w_time = clock_to_movetime(series.w_time, base, inc)
+            series.b_time = clock_to_movetime(series.b_time, base, inc)
+
+        return series
+
+    def plotter(self, series, outputfn):
+        """
+        Plot the eval and time of the game series and save it to outputfn.
+        """
+        ev, da, rd = series.event, series.date, series.round
+        wp, bp, res = series.white, series.black, series.result
+        game_num = series.num
+
+        move_num = list(series.move_num)
+        w_eval = np.frombuffer(series.w_eval, dtype=np.float32)
+        w_time = np.frombuffer(series.w_time, dtype=np.float32)
+
+        # Positive eval is good for white while negative eval is good for black.
+        b_eval = -np.frombuffer(series.b_eval, dtype=np.float32)
+        b_time = np.frombuffer(series.b_time, dtype=np.float32)
+
         fig, ax = plt.subplots(2, sharex=True, figsize=(self.fig_width, self.fig_height))
 
         plt.text(x=0.5, y=0.94, s=f"{wp} vs {bp}", fontsize=8, ha="center", transform=fig.transFigure)
@@ -282,11 +489,11 @@ class GameInfoPlotter:
 
         # Array should have the same size.
         if len(move_num) > len(b_eval):
-            b_eval.append(b_eval[len(b_eval)-1])
-            b_time.append(0)
+            b_eval = np.append(b_eval, b_eval[len(b_eval)-1])
+            b_time = np.append(b_time, 0)
         if len(move_num) > len(w_eval):
-            w_eval.append(w_eval[len(w_eval)-1])
-            w_time.append(0)
+            w_eval = np.append(w_eval, w_eval[len(w_eval)-1])
+            w_time = np.append(w_time, 0)
 
         line_width = 1.0
         ax[0].plot(move_num, w_eval, color=self.white_line_color, linewidth=line_width, label=f'{wp}')
@@ -364,21 +571,59 @@ class GameInfoPlotter:
         with open(self.plot_file) as f:
             for lines in f:
                 line = lines.strip()
-                plot_games.append(int(line))
+                try:
+                    plot_games.append(int(line))
+                except ValueError:
+                    if line:
+                        print(f'Skipped line {line!r} in {self.plot_file}, not a game number.')
 
         return plot_games
 
-    def run(self):
-        start_time = time.perf_counter()
+    def is_duplicate(self, game, cnt):
+        """
+        Returns True if the game moves were seen in an earlier game.
+        """
+        moves = [m.uci() for m in game.mainline_moves()]
+        first = self.seen.add(game_fingerprint(moves, game.headers, self.dedup_headers), cnt)
+        if first is None:
+            return False
+
+        self.duplicates += 1
+        print(f'game: {cnt} is a duplicate of game {first}, skipped')
+        return True
+
+    def select_games(self, pgn, game_num_to_plot):
+        """
+        Yield (game number, game) of the games in the plot file that pass
+        the --where filter.
+
+        Games are numbered as in an unfiltered run. When a plot file or a
+        filter is used only the headers of a game are parsed first, the
+        movetext of rejected games is skipped. With --dedup repeated games
+        are skipped too, among the selected games only. With --shard the
+        games of other shards are skipped without parsing.
+
+        self.game_span has the byte offsets of the game yielded.
+        """
         cnt = 0
+        while True:
+            if self.shard is not None and cnt % self.shard[1] != self.shard[0] - 1:
+                if not chess.pgn.skip_game(pgn):
+                    break
+                cnt += 1
+                continue
 
-        game_num_to_plot = self.plot_game_num()
+            offset = pgn.tell()
 
-        with open(self.input_pgn) as pgn:
-            while True:
+            if self.plot_file is None and not self.where:
                 game = chess.pgn.read_game(pgn)
                 if game is None:
                     break
+                cnt += 1
+            else:
+                headers = chess.pgn.read_headers(pgn)
+                if headers is None:
+                    break
 
                 cnt += 1
 
@@ -386,25 +631,459 @@ class GameInfoPlotter:
                     if cnt not in game_num_to_plot:
                         continue
 
-                output = f'{self.input_pgn[0:-4]}_{cnt}.png'
+                if not match_where(headers, self.where):
+                    continue
+
+                pgn.seek(offset)
+                game = chess.pgn.read_game(pgn)
+
+            self.game_span = (offset, pgn.tell())
+
+            if self.seen is not None and self.is_duplicate(game, cnt):
+                continue
+
+            yield cnt, game
+
+    def html_game(self, series):
+        """
+        Returns the game series as a json ready dict for the html report.
+        Black eval is converted to WPOV as in the png plot.
+        """
+        def values(arr, sign=1):
+            return [None if v != v else round(sign * v, 2) for v in arr]
+
+        return {'num': series.num, 'white': series.white, 'black': series.black,
+                'result': series.result, 'event': series.event, 'date': series.date,
+                'round': series.round, 'move': list(series.move_num),
+                'w_eval': values(series.w_eval), 'b_eval': values(series.b_eval, -1),
+                'w_time': values(series.w_time), 'b_time': values(series.b_time)}
+
+    def write_html(self, games, outputfn):
+        """
+        Save all games in one self-contained html file.
+        """
+        options = {'mineval': self.min_eval, 'maxeval': self.max_eval,
+                   'minmove': self.min_move_limit, 'maxmove': self.max_move_limit,
+                   'white_line_color': mcolors.to_hex(self.white_line_color),
+                   'black_line_color': mcolors.to_hex(self.black_line_color),
+                   'plot_eval_bg_color': mcolors.to_hex(self.plot_eval_bg_color),
+                   'plot_time_bg_color': mcolors.to_hex(self.plot_time_bg_color)}
+
+        def to_json(obj):
+            # Keep the data from closing the script element.
+            return json.dumps(obj, separators=(',', ':')).replace('</', '<\\/')
+
+        page = HTML_TEMPLATE.replace('__TITLE__', Path(self.input_pgn).name)
+        page = page.replace('__OPTIONS__', to_json(options))
+        page = page.replace('__GAMES__', to_json(games))
+
+        with open(outputfn, 'w', encoding='utf-8') as f:
+            f.write(page)
+
+    def add_density_game(self, series):
+        """
+        Queue the moves and evals of both engines, evals are in the
+        engine's own POV.
+        """
+        w_eval = np.frombuffer(series.w_eval, dtype=np.float32)
+        b_eval = np.frombuffer(series.b_eval, dtype=np.float32)
+        w_moves, b_moves = side_move_numbers(series)
+
+        self.density_batch.append((series.white, w_moves, w_eval))
+        self.density_batch.append((series.black, b_moves, b_eval))
+
+        if len(self.density_batch) >= 2 * DENSITY_BATCH_SIZE:
+            self.flush_density()
+
+    def flush_density(self):
+        """
+        Bin the queued evals into the per engine 2D histograms with one
+        bincount over the concatenated batch.
+        """
+        if not self.density_batch:
+            return
+
+        names = sorted({name for name, _, _ in self.density_batch})
+        name_id = {name: i for i, name in enumerate(names)}
+
+        eng = np.concatenate([np.full(len(m), name_id[name]) for name, m, _ in self.density_batch])
+        moves = np.concatenate([m for _, m, _ in self.density_batch])
+        evals = np.concatenate([e for _, _, e in self.density_batch])
+        self.density_batch = []
+
+        keep = ~np.isnan(evals)
+        if self.min_move_limit is not None:
+            keep &= moves >= self.min_move_limit
+        if self.max_move_limit is not None:
+            keep &= moves <= self.max_move_limit
+        eng, moves, evals = eng[keep], moves[keep], evals[keep]
+
+        if len(moves) == 0:
+            return
+
+        width = (self.max_eval - self.min_eval) / DENSITY_EVAL_BINS
+        bins = ((np.clip(evals, self.min_eval, self.max_eval) - self.min_eval) / width).astype(np.int64)
+        bins = np.minimum(bins, DENSITY_EVAL_BINS - 1)
+
+        rows = int(moves.max()) + 1
+        key = (eng * rows + moves) * DENSITY_EVAL_BINS + bins
+        counts = np.bincount(key, minlength=len(names) * rows * DENSITY_EVAL_BINS)
+        counts = counts.reshape(len(names), rows, DENSITY_EVAL_BINS)
+
+        for name, i in name_id.items():
+            self.add_density_counts(name, counts[i])
+
+    def add_density_counts(self, name, counts):
+        """
+        Add [move number, eval bin] counts to the histogram of the engine.
+        """
+        rows = len(counts)
+        acc = self.density_counts.get(name)
+        if acc is None:
+            acc = np.zeros((rows, DENSITY_EVAL_BINS), dtype=np.int64)
+        elif len(acc) < rows:
+            acc = np.vstack([acc, np.zeros((rows - len(acc), DENSITY_EVAL_BINS), dtype=np.int64)])
+        acc[:rows] += counts
+        self.density_counts[name] = acc
+
+    def plot_density(self, outputfn):
+        """
+        Save one figure with the eval vs move number heatmap of each engine
+        and its median and 25/75 percentile lines. Returns False if there
+        is no eval to plot.
+        """
+        self.flush_density()
+
+        engines = sorted(self.density_counts, key=lambda n: -self.density_counts[n].sum())
+        engines = engines[0:DENSITY_MAX_ENGINES]
+        if not engines:
+            print('No evals to plot.')
+            return False
+
+        edges = np.linspace(self.min_eval, self.max_eval, DENSITY_EVAL_BINS + 1)
+        centers = (edges[:-1] + edges[1:]) / 2
+
+        fig, ax = plt.subplots(len(engines), sharex=True, squeeze=False,
+                               figsize=(self.fig_width, max(self.fig_height, 2 * len(engines))))
+        ax = ax[:, 0]
+
+        plt.text(x=0.5, y=0.98, s=f"{Path(self.input_pgn).name}", fontsize=8, ha="center",
+                 va='top', transform=fig.transFigure)
+
+        for a, name in zip(ax, engines):
+            counts = self.density_counts[name]
+            total = counts.sum(axis=1)
+            moves = np.flatnonzero(total)
+            lo, hi = moves.min(), moves.max()
+
+            # Share of moves in each eval bin, per move number.
+            share = counts[lo:hi + 1] / np.maximum(total[lo:hi + 1], 1)[:, None]
+            share = np.ma.masked_equal(share, 0)
+            a.pcolormesh(np.arange(lo, hi + 2) - 0.5, edges, share.T, cmap='viridis', shading='flat')
+
+            cdf = np.cumsum(counts[lo:hi + 1], axis=1) / np.maximum(total[lo:hi + 1], 1)[:, None]
+            x = np.arange(lo, hi + 1)
+            has_data = total[lo:hi + 1] > 0
+            for q, color, style in [(0.5, self.white_line_color, '-'),
+                                    (0.25, self.black_line_color, '--'),
+                                    (0.75, self.black_line_color, '--')]:
+                y = np.where(has_data, centers[np.argmax(cdf >= q, axis=1)], np.nan)
+                a.plot(x, y, color=color, linestyle=style, linewidth=0.8,
+                       label='median' if q == 0.5 else f'{int(q * 100)}%')
+
+            a.axhline(y=0.0, color='r', linestyle='-', linewidth=0.1)
+            a.set_facecolor(self.plot_eval_bg_color)
+            a.set_title(f'{name}, {int(total.sum())} moves', fontsize=7)
+            a.set_ylabel('Score in pawn unit', fontsize=5)
+            a.set_ylim(self.min_eval, self.max_eval)
+            plt.setp(a.get_xticklabels(), fontsize=5)
+            plt.setp(a.get_yticklabels(), fontsize=5)
+            a.legend(loc='best')
+
+        ax[-1].set_xlabel('Move number', fontsize=5)
+
+        plt.subplots_adjust(top=0.92, hspace=0.4)
+        plt.savefig(outputfn, dpi=self.dpi)
+        plt.close()
+
+        return True
+
+    def add_time_game(self, series):
+        """
+        Queue the move numbers and time per move of both engines.
+        """
+        w_moves, b_moves = side_move_numbers(series)
+
+        self.time_batch.append((series.white, w_moves, np.frombuffer(series.w_time, dtype=np.float32)))
+        self.time_batch.append((series.black, b_moves, np.frombuffer(series.b_time, dtype=np.float32)))
+
+        if len(self.time_batch) >= 2 * DENSITY_BATCH_SIZE:
+            self.flush_time()
+
+    def flush_time(self):
+        """
+        Add the queued times to the per engine and phase sums and counts.
+        """
+        if not self.time_batch:
+            return
+
+        names = sorted({name for name, _, _ in self.time_batch})
+        name_id = {name: i for i, name in enumerate(names)}
+
+        eng = np.concatenate([np.full(len(m), name_id[name]) for name, m, _ in self.time_batch])
+        moves = np.concatenate([m for _, m, _ in self.time_batch])
+        times = np.concatenate([t for _, _, t in self.time_batch]).astype(np.float64)
+        self.time_batch = []
+
+        keep = ~np.isnan(times)
+        eng, moves, times = eng[keep], moves[keep], times[keep]
+
+        nphases = len(TIME_PHASES)
+        phase = np.digitize(moves, [first for _, first in TIME_PHASES[1:]])
+        key = eng * nphases + phase
 
-                print(f'game: {cnt}')
+        sums = np.bincount(key, weights=times, minlength=len(names) * nphases).reshape(-1, nphases)
+        counts = np.bincount(key, minlength=len(names) * nphases).reshape(-1, nphases)
 
-                self.plotter(game, output, cnt)
+        for name, i in name_id.items():
+            self.time_sum[name] = self.time_sum.get(name, 0) + sums[i]
+            self.time_count[name] = self.time_count.get(name, 0) + counts[i]
+
+    def report_time(self, outputfn):
+        """
+        Print the time use per engine and game phase and save a summary plot
+        of the average time per move. Returns False if there is no time to
+        report.
+        """
+        self.flush_time()
+
+        engines = sorted(self.time_sum, key=lambda n: -self.time_count[n].sum())
+        if not engines:
+            print('No times to report.')
+            return False
+
+        print(f'{"Engine":<40} {"Phase":<10} {"Moves":>8} {"AvgSec":>9} {"TotalSec":>12} {"Share%":>7}')
+        for name in engines:
+            total = self.time_sum[name].sum()
+            for i, (phase, _) in enumerate(TIME_PHASES):
+                cnt = self.time_count[name][i]
+                tsum = self.time_sum[name][i]
+                avg = tsum / cnt if cnt else 0.0
+                share = 100 * tsum / total if total else 0.0
+                print(f'{name:<40} {phase:<10} {cnt:>8} {avg:>9.2f} {tsum:>12.1f} {share:>7.1f}')
+
+        fig, ax = plt.subplots(figsize=(self.fig_width, self.fig_height))
+
+        width = 0.8 / len(engines)
+        x = np.arange(len(TIME_PHASES))
+        for k, name in enumerate(engines):
+            avg = self.time_sum[name] / np.maximum(self.time_count[name], 1)
+            ax.bar(x + (k - (len(engines) - 1) / 2) * width, avg, width, label=name)
+
+        ax.set_xticks(x)
+        ax.set_xticklabels([f'{phase}\nmove {first}+' for phase, first in TIME_PHASES], fontsize=6)
+        plt.setp(ax.get_yticklabels(), fontsize=5)
+        ax.set_title(f'Average time per move, {Path(self.input_pgn).name}', fontsize=7)
+        ax.set_ylabel('movetime in sec', fontsize=5)
+        ax.set_facecolor(self.plot_time_bg_color)
+        ax.grid(linewidth=0.1)
+        ax.legend(loc='best')
+
+        plt.savefig(outputfn, dpi=self.dpi)
+        plt.close()
+
+        return True
+
+    def output_base(self):
+        """
+        Returns the output filename without suffix. With an output folder
+        the path of the input below input_root is kept.
+        """
+        if self.output_dir is None:
+            return self.input_pgn[0:-4]
+
+        root = self.input_root or str(Path(self.input_pgn).parent)
+        out = Path(self.output_dir) / Path(os.path.relpath(self.input_pgn, root)).with_suffix('')
+
+        return str(out)
+
+    def write_manifest(self, plots, html_games, errors):
+        """
+        Save what this shard rendered or counted in a json file that also
+        records the input, shard and settings. Returns the filename, see
+        merge_manifests().
+        """
+        i, n = self.shard
+        fn = f'{self.output_base()}_shard_{i}_of_{n}.json'
+
+        self.flush_density()
+        self.flush_time()
+
+        manifest = {'script': __script_name__, 'version': __version__,
+                    'input': self.input_pgn, 'input_size': os.path.getsize(self.input_pgn),
+                    'output_base': self.output_base(),
+                    'shard': i, 'shards': n, 'settings': self.settings,
+                    'plots': plots, 'html_games': html_games,
+                    'density': {name: c.tolist() for name, c in self.density_counts.items()},
+                    'time': {name: [self.time_sum[name].tolist(), self.time_count[name].tolist()]
+                             for name in self.time_sum},
+                    'errors': errors}
+
+        with open(fn, 'w') as f:
+            json.dump(manifest, f)
+
+        return fn
+
+    def run(self):
+        start_time = time.perf_counter()
+
+        game_num_to_plot = set(self.plot_game_num())
+        html_games = []
+        plots = []
+        quarantine = Quarantine(self.input_pgn, output_name('quarantine_', self.input_pgn, self.input_root, self.shard),
+                                self.max_errors)
+
+        # Bytes that are not utf-8 are read as U+FFFD and tell() is a byte
+        # offset for the quarantine.
+        with open(self.input_pgn, encoding='utf-8', errors='replace') as pgn:
+            for cnt, game in self.select_games(pgn, game_num_to_plot):
+                output = f'{self.output_base()}_{cnt}.png'
+
+                if self.verbose:
+                    print(f'game: {cnt}')
+
+                try:
+                    series = self.parse_game(game, cnt)
+
+                    if self.html:
+                        html_games.append(self.html_game(series))
+                    elif not self.density and not self.time_report:
+                        self.plotter(series, output)
+                        plots.append([cnt, output])
+                except Exception as e:
+                    plt.close('all')
+                    quarantine.add(cnt, *self.game_span, e)
+                    continue
+
+                # The density and time batches are flushed outside of the
+                # per game guard, a failed flush is not the fault of this game.
+                if self.html:
+                    continue
+                if self.density:
+                    self.add_density_game(series)
+                elif self.time_report:
+                    self.add_time_game(series)
+
+        quarantine.close()
+
+        if self.shard is not None:
+            output = self.write_manifest(plots, html_games, quarantine.errors)
+            print(f'Saved {output}')
+        elif self.density:
+            output = f'{self.output_base()}_density.png'
+            if self.plot_density(output):
+                print(f'Saved {output}')
+        elif self.time_report:
+            output = f'{self.output_base()}_time.png'
+            if self.report_time(output):
+                print(f'Saved {output}')
+        elif self.html:
+            output = f'{self.output_base()}.html'
+            self.write_html(html_games, output)
+            print(f'Saved {output}')
+
+        if self.seen is not None:
+            self.seen.close()
+            print(f'Duplicates skipped: {self.duplicates}')
+
+        if self.analyzer is not None:
+            self.analyzer.close()
 
         print(f'Done {self.input_pgn}, Elapse (sec): {time.perf_counter() - start_time:0.3f}')
 
 
-def spov_score(wpov_score, stm):
-    return wpov_score if stm else -wpov_score
+def plot_file_in_batch(input_pgn, input_root, options):
+    """
+    Process one pgn file of a batch in a worker process.
+    """
+    GameInfoPlotter(input_pgn, input_root=input_root, verbose=False, **options).run()
+
+
+def merge_manifests(files):
+    """
+    Save the html, density or time report of a sharded run from the
+    manifests of its shards, or list the plots of all shards in game order.
+    """
+    start_time = time.perf_counter()
+
+    parts = []
+    for fn in files:
+        with open(fn) as f:
+            parts.append((fn, json.load(f)))
+
+    check_partials(parts, __script_name__)
+
+    first = parts[0][1]
+    settings = first['settings']
+    base = first['output_base']
+    plotter = GameInfoPlotter(first['input'], None, verbose=False, **settings)
+
+    if settings['density']:
+        for _, p in parts:
+            for name, counts in p['density'].items():
+                plotter.add_density_counts(name, np.array(counts, dtype=np.int64).reshape(-1, DENSITY_EVAL_BINS))
+        output = f'{base}_density.png'
+        if plotter.plot_density(output):
+            print(f'Saved {output}')
+    elif settings['time_report']:
+        for _, p in parts:
+            for name, (tsum, tcount) in p['time'].items():
+                plotter.time_sum[name] = plotter.time_sum.get(name, 0) + np.array(tsum)
+                plotter.time_count[name] = plotter.time_count.get(name, 0) + np.array(tcount)
+        output = f'{base}_time.png'
+        if plotter.report_time(output):
+            print(f'Saved {output}')
+    elif settings['html']:
+        games = sorted((g for _, p in parts for g in p['html_games']), key=lambda g: g['num'])
+        output = f'{base}.html'
+        plotter.write_html(games, output)
+        print(f'Saved {output}')
+    else:
+        plots = sorted(plot for _, p in parts for plot in p['plots'])
+        for cnt, output in plots:
+            print(f'game: {cnt}, {output}')
+        print(f'Plots: {len(plots)}')
+
+    errors = sum(p['errors'] for _, p in parts)
+    if errors:
+        print(f'Errors: {errors}, see the quarantine files of the shards')
+
+    print(f'Done merge of {len(parts)} shards of {first["input"]}, '
+          f'Elapse (sec): {time.perf_counter() - start_time:0.3f}')
+
+
+def side_move_numbers(series):
+    """
+    Returns the move numbers of the white and black moves of the series.
+    """
+    w_first = (series.start_ply + series.start_ply % 2) // 2 + 1
+    b_first = (series.start_ply + 1 - series.start_ply % 2) // 2 + 1
+
+    return w_first + np.arange(len(series.w_eval)), b_first + np.arange(len(series.b_eval))
 
 
 def main():
     parser = argparse.ArgumentParser(
         prog='%s %s' % (__script_name__, __version__),
         description=__goal__, epilog='%(prog)s')
-    parser.add_argument('--input', required=True, type=str,
-                        help='Input pgn filename (required).')
+    parser.add_argument('--input', required=False, type=str, nargs='+',
+                        help='Input pgn filename (required). Folders and glob patterns like '
+                             '"archive/**/*.pgn" are processed in a batch.')
+    parser.add_argument('--output-dir', required=False, type=str,
+                        help='Folder where output files are saved, the folders below the input '
+                             'folder are kept. Default is next to the input file.')
+    parser.add_argument('--workers', required=False, type=int,
+                        help='Number of worker processes in a batch, default is the number of cpus.')
     parser.add_argument('--figure-size-width',
                         required=False, type=int,
                         default=6,
@@ -457,13 +1136,78 @@ def main():
                         help='Use this flag if pgn is from lichess.')
     parser.add_argument('--plot-file', required=False, type=str,
                         help='Input filename where specific game number will be plotted (not required).')
+    parser.add_argument('--where', required=False, type=str,
+                        help='Only plot games whose headers match this filter, example: '
+                             '"White~Stockfish and Result=1-0 and Date>=2023.01.01". '
+                             'Operators: = != ~ (contains) !~ < <= > >=. Game numbers are kept '
+                             'as in an unfiltered run so --plot-file numbers still apply.')
+    parser.add_argument('--html',
+                        action='store_true',
+                        help='Save all games in one interactive html file instead of a png per game.')
+    parser.add_argument('--density',
+                        action='store_true',
+                        help='Save one png with the eval vs move number density of each engine '
+                             'over all selected games instead of a png per game.')
+    parser.add_argument('--time-report',
+                        action='store_true',
+                        help='Print the time use per engine and game phase over all selected games '
+                             'and save one summary png instead of a png per game.')
+    parser.add_argument('--dedup',
+                        action='store_true',
+                        help='Skip games whose moves are the same as an earlier game.')
+    parser.add_argument('--dedup-headers', required=False, type=str, default='',
+                        help='Comma separated header tags that are also compared by --dedup, '
+                             'example White,Black (not required).')
+    parser.add_argument('--dedup-db', required=False, type=str,
+                        help='Keep the --dedup fingerprints in this sqlite file instead of memory (not required).')
+    parser.add_argument('--engine', required=False, type=str,
+                        help='Uci engine path, moves without an eval in the comment are analysed '
+                             'by this engine (not required).')
+    parser.add_argument('--engine-workers', required=False, type=int, default=1,
+                        help='Number of engine processes, default=1.')
+    parser.add_argument('--engine-depth', required=False, type=int,
+                        help=f'Engine search depth, default={ENGINE_DEPTH} if --engine-nodes is not set.')
+    parser.add_argument('--engine-nodes', required=False, type=int,
+                        help='Engine search nodes (not required).')
+    parser.add_argument('--engine-cache', required=False, type=str,
+                        help='Sqlite file where engine scores are kept across runs (not required).')
+    parser.add_argument('--max-errors', required=False, type=int,
+                        help='Stop when more than this number of games fail, default is no limit. '
+                             'Games that fail are saved in quarantine_<input> with a log.')
+    parser.add_argument('--shard', required=False, type=str,
+                        help='Process only shard i of N of the input, example 2/8. Game n is in shard '
+                             '(n - 1) %% N + 1. What the shard saved is listed in '
+                             '<input>_shard_<i>_of_<N>.json for --merge.')
+    parser.add_argument('--merge', required=False, type=str, nargs='+',
+                        help='Save the html, density or time report from the json files or glob '
+                             'pattern of all --shard runs, or list their plots.')
     parser.add_argument('-v', '--version', action='version',
                         version=f'{__version__}')
 
     args = parser.parse_args()
 
-    a = GameInfoPlotter(
-        args.input, args.plot_file,
+    if args.merge is not None:
+        files = [fn for item in args.merge for fn in (sorted(glob.glob(item)) or [item])]
+        try:
+            merge_manifests(files)
+        except ValueError as e:
+            sys.exit(f'Merge failed: {e}')
+        return
+
+    if args.input is None:
+        parser.error('the following arguments are required: --input')
+
+    shard = None
+    if args.shard is not None:
+        if args.dedup:
+            parser.error('--dedup can not be used with --shard, a duplicate can be in another shard.')
+        try:
+            shard = parse_shard(args.shard)
+        except ValueError as e:
+            parser.error(str(e))
+
+    options = dict(
+        plot_file=args.plot_file,
         width=args.figure_size_width,
         height=args.figure_size_height,
         min_eval_limit=args.min_eval_limit,
@@ -476,9 +1220,38 @@ def main():
         white_line_color=args.white_line_color,
         black_line_color=args.black_line_color,
         min_move_limit=args.min_move_limit,
-        max_move_limit=args.max_move_limit)
-
-    a.run()
+        max_move_limit=args.max_move_limit,
+        where=args.where,
+        html=args.html,
+        density=args.density,
+        time_report=args.time_report,
+        dedup=args.dedup,
+        dedup_headers=args.dedup_headers,
+        dedup_db=args.dedup_db,
+        engine=args.engine,
+        engine_workers=args.engine_workers,
+        engine_depth=args.engine_depth,
+        engine_nodes=args.engine_nodes,
+        engine_cache=args.engine_cache,
+        max_errors=args.max_errors,
+        shard=shard,
+        output_dir=args.output_dir)
+
+    if len(args.input) == 1 and Path(args.input[0]).is_file():
+        a = GameInfoPlotter(args.input[0], **options)
+        try:
+            a.run()
+        except TooManyErrors as e:
+            print(f'Aborted {args.input[0]}: {e}')
+        return
+
+    if shard is not None:
+        parser.error('--shard is supported for one input file.')
+
+    if args.dedup_db is not None:
+        parser.error('--dedup-db is not supported in a batch, --dedup is done per file.')
+
+    run_batch(expand_inputs(args.input), plot_file_in_batch, options, args.workers)
 
 
 if __name__ == "__main__":
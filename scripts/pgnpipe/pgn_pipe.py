@@ -0,0 +1,240 @@
+#!/usr/bin/env python
+
+
+"""
+pgn_pipe.py
+
+Apply a chain of transforms to each game of a pgn file in one pass.
+
+Each game is parsed once, the ops are applied in the given order and the
+game is written once.
+
+Ops:
+  strip-nags[:ply=N]          Remove nags below ply N (pc_0001 rule), all if ply is not given.
+  flip                        Flip the board and swap colors (flip_pgn).
+  strip-comments              Remove all comments.
+  strip-variations[:plies=N]  Remove variations, or keep their first N plies.
+  eval-headers[:fmt=F]        Save min/max eval of each side in the header
+                              (evalswing --save-game), F is cutechess, tcec,
+                              lichess or chessbase, add :wpov=1 for cutechess
+                              scores in wpov.
+
+
+Setup:
+  Install python 3.8 or newer
+
+
+Requirements:
+  python-chess==1.2.0
+
+
+Usage:
+    python pgn_pipe.py --input mygames.pgn --ops strip-nags:ply=10,flip,strip-comments
+"""
+
+
+__version__ = 'v0.2.0'
+__script_name__ = 'pgnpipe'
+__goal__ = 'Apply a chain of transforms to each game of a pgn file in one pass.'
+
+
+import argparse
+import os
+import sys
+import time
+from pathlib import Path
+
+import chess.pgn
+
+# Code shared by the scripts is in scripts/pgncommon.
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'pgncommon'))
+from pgn_common import Quarantine, TooManyErrors, parse_comment, swap_tags
+
+
+def all_nodes(game):
+    """
+    Yield (ply, node) of every move node of the game, variations included.
+    ply is 1 for the first move.
+    """
+    stack = [(0, v) for v in reversed(game.variations)]
+    while stack:
+        ply, node = stack.pop()
+        yield ply + 1, node
+        stack.extend((ply + 1, v) for v in reversed(node.variations))
+
+
+def op_strip_nags(game, ply=None):
+    """
+    Remove nags of moves below ply, as pc_0001 --no-nag-ply.
+    """
+    for node_ply, node in all_nodes(game):
+        if ply is None or node_ply < int(ply):
+            node.nags = set()
+    return game
+
+
+def op_flip(game):
+    """
+    Flip the board, the moves and swap the player tags, as flip_pgn.
+    Comments, nags and variations are kept.
+    """
+    fgame = chess.pgn.Game()
+    fgame.setup(game.board().mirror())
+    swap_tags(game, fgame)
+    fgame.comment = game.comment
+
+    stack = [(game, fgame)]
+    while stack:
+        node, fnode = stack.pop()
+        for v in node.variations:
+            move = chess.Move(chess.square_mirror(v.move.from_square),
+                              chess.square_mirror(v.move.to_square),
+                              promotion=v.move.promotion)
+            fchild = fnode.add_variation(move, comment=v.comment, starting_comment=v.starting_comment,
+                                         nags=v.nags)
+            stack.append((v, fchild))
+
+    return fgame
+
+
+def op_strip_comments(game):
+    game.comment = ''
+    for _, node in all_nodes(game):
+        node.comment = ''
+        node.starting_comment = ''
+    return game
+
+
+def op_strip_variations(game, plies=0):
+    """
+    Remove side variations or cut them after the given number of plies.
+    """
+    plies = int(plies)
+    for node in [game] + [n for _, n in all_nodes(game) if n.is_mainline()]:
+        for v in node.variations[1:]:
+            if plies == 0:
+                node.remove_variation(v)
+                continue
+            # Keep only the main line of the variation for plies moves.
+            cur, depth = v, 1
+            while cur.variations:
+                if depth >= plies:
+                    cur.variations = []
+                    break
+                cur.variations = cur.variations[0:1]
+                cur, depth = cur.variations[0], depth + 1
+    return game
+
+
+def op_eval_headers(game, fmt='cutechess', wpov=0):
+    """
+    Save the min and max eval of each side in SPOV in the header.
+    """
+    evals = {chess.WHITE: [], chess.BLACK: []}
+    turn = game.board().turn
+    for node in game.mainline():
+        value = parse_comment(node.comment, fmt, turn, spov=not int(wpov))
+        if value is not None:
+            evals[turn].append(value[0])
+        turn = not turn
+
+    for color, name in [(chess.WHITE, 'White'), (chess.BLACK, 'Black')]:
+        if evals[color]:
+            game.headers[f'{name}MaxEval'] = str(round(max(evals[color]), 2))
+            game.headers[f'{name}MinEval'] = str(round(min(evals[color]), 2))
+
+    return game
+
+
+OPS = {
+    'strip-nags': op_strip_nags,
+    'flip': op_flip,
+    'strip-comments': op_strip_comments,
+    'strip-variations': op_strip_variations,
+    'eval-headers': op_eval_headers,
+}
+
+
+def parse_ops(spec):
+    """
+    Returns [(op function, params)] from a spec like
+    strip-nags:ply=10,flip,strip-comments
+    """
+    ops = []
+    for item in spec.split(','):
+        name, *params = item.strip().split(':')
+        if name not in OPS:
+            raise ValueError(f'Unknown op {name!r}, use one of {", ".join(OPS)}.')
+        kwargs = dict(p.split('=', 1) for p in params)
+        ops.append((OPS[name], kwargs))
+    return ops
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog='%s %s' % (__script_name__, __version__),
+        description=__goal__, epilog='%(prog)s')
+    parser.add_argument('--input', required=True,
+                        help='Input pgn filename (required).')
+    parser.add_argument('--output', required=False,
+                        help='Output pgn filename (not required). If not specified'
+                             ' it will be written in out_<input>.')
+    parser.add_argument('--ops', required=True,
+                        help='Comma separated ops applied in order, example '
+                             'strip-nags:ply=10,flip,strip-comments (required). '
+                             f'Ops: {", ".join(OPS)}.')
+    parser.add_argument('--max-errors', required=False, type=int,
+                        help='Stop when more than this number of games fail, default is no limit. '
+                             'Games that fail are saved in quarantine_<input> with a log.')
+    parser.add_argument('-v', '--version', action='version',
+                        version=f'{__version__}')
+
+    args = parser.parse_args()
+
+    try:
+        ops = parse_ops(args.ops)
+    except ValueError as e:
+        parser.error(str(e))
+
+    start_time = time.perf_counter()
+
+    infn = args.input
+    outfn = args.output
+    if outfn is None:
+        outfn = f'out_{infn}'
+
+    quarantine = Quarantine(infn, f'quarantine_{os.path.basename(infn)}', args.max_errors)
+
+    # Bytes that are not utf-8 go through the ops as they are with
+    # surrogateescape, and tell() is the byte offset of a game.
+    cnt = 0
+    try:
+        with open(infn, encoding='utf-8', errors='surrogateescape') as pgn, \
+                open(outfn, 'w', encoding='utf-8', errors='surrogateescape') as w:
+            while True:
+                start = pgn.tell()
+                game = chess.pgn.read_game(pgn)
+                if game is None:
+                    break
+
+                cnt += 1
+
+                try:
+                    for op, kwargs in ops:
+                        game = op(game, **kwargs)
+                    text = str(game)
+                except Exception as e:
+                    quarantine.add(cnt, start, pgn.tell(), e)
+                    continue
+
+                w.write(f'{text}\n\n')
+    except TooManyErrors as e:
+        print(f'Aborted {infn}: {e}')
+
+    quarantine.close()
+
+    print(f'Done {infn}, games: {cnt}, Elapse (sec): {time.perf_counter() - start_time:0.3f}')
+
+
+if __name__ == "__main__":
+    main()
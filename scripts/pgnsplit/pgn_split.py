@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+
+
+"""
+pgn_split.py
+
+Split a pgn file into files named from the game headers in one pass.
+
+The output filename of a game is made from a template of header tags, for
+example {Event}/{White}_vs_{Black}.pgn. Only the headers of a game are
+parsed, the game text is copied as it is from the input.
+
+
+Setup:
+  Install python 3.8 or newer
+
+
+Requirements:
+  python-chess==1.2.0
+
+
+Usage:
+    python pgn_split.py --input archive.pgn --template "{White}.pgn"
+    python pgn_split.py --input archive.pgn --template "{Event}/{White}_vs_{Black}.pgn" --output-dir split
+"""
+
+
+__version__ = 'v0.1.0'
+__script_name__ = 'pgnsplit'
+__goal__ = 'Split a pgn file into files named from the game headers in one pass.'
+
+
+import argparse
+import codecs
+import os
+import re
+import string
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+import chess.pgn
+
+
+UNSAFE_CHARS = re.compile(r'[^\w.\- ]+')
+
+
+class HeaderValues(dict):
+    """
+    Header values for the template, a missing tag is 'unknown' and Year
+    is the year of the Date tag.
+    """
+    def __missing__(self, key):
+        if key == 'Year':
+            return sanitize(self.get('Date', '????')[:4])
+        return 'unknown'
+
+
+class FilePool:
+    """
+    Output files kept open in least recently used order, at most max_open
+    at a time. A file is created the first time it is opened and appended
+    to when it is opened again after being closed.
+    """
+    def __init__(self, max_open=256):
+        self.max_open = max_open
+        self.handles = OrderedDict()
+        self.created = set()
+        self.reopens = 0
+
+    def get(self, path):
+        f = self.handles.get(path)
+        if f is not None:
+            self.handles.move_to_end(path)
+            return f
+
+        if len(self.handles) >= self.max_open:
+            _, oldest = self.handles.popitem(last=False)
+            oldest.close()
+
+        if path in self.created:
+            self.reopens += 1
+            f = open(path, 'ab')
+        else:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            f = open(path, 'wb')
+            self.created.add(path)
+
+        self.handles[path] = f
+        return f
+
+    def close(self):
+        for f in self.handles.values():
+            f.close()
+        self.handles.clear()
+
+
+def sanitize(value):
+    """
+    Returns the header value made safe as a file or folder name.
+    """
+    value = UNSAFE_CHARS.sub('_', value).strip(' .')
+    return value or 'unknown'
+
+
+def target_path(template, headers, output_dir):
+    values = HeaderValues((k, sanitize(v)) for k, v in headers.items())
+    return os.path.join(output_dir, template.format_map(values))
+
+
+def check_template(template):
+    """
+    Raises ValueError if the template has no tag, or has a field that is not
+    a plain tag name.
+    """
+    fields = [(field, spec, conv) for _, field, spec, conv in string.Formatter().parse(template)
+              if field is not None]
+    if not fields:
+        raise ValueError(f'Template {template!r} has no header tag, example "{{White}}.pgn".')
+    for field, spec, conv in fields:
+        if not re.fullmatch(r'\w+', field) or spec or conv:
+            raise ValueError(f'Invalid template field {{{field}}}, use header tag names like {{White}}.')
+    if os.path.isabs(template) or '..' in Path(template).parts:
+        raise ValueError(f'Template {template!r} must be a path inside the output folder.')
+
+
+def split_pgn(pgninfn, template, output_dir, max_open):
+    """
+    Copy each game of the input to the file of its headers. Returns the
+    number of games, files and file reopens.
+    """
+    pool = FilePool(max_open)
+    cnt = 0
+
+    # The utf-8 codec makes tell() a byte offset in raw, bytes that are not
+    # utf-8, as in latin-1 files, are kept by surrogateescape. A utf-8 BOM
+    # is not copied to the first output file.
+    try:
+        with open(pgninfn, encoding='utf-8', errors='surrogateescape') as pgn, open(pgninfn, 'rb') as raw:
+            start = len(codecs.BOM_UTF8) if raw.read(len(codecs.BOM_UTF8)) == codecs.BOM_UTF8 else 0
+            raw.seek(start)
+            while True:
+                headers = chess.pgn.read_headers(pgn)
+                if headers is None:
+                    break
+
+                cnt += 1
+                end = pgn.tell()
+
+                # The games are contiguous, the raw handle is always at start.
+                text = raw.read(end - start)
+                start = end
+
+                pool.get(target_path(template, headers, output_dir)).write(text.strip() + b'\n\n')
+    finally:
+        pool.close()
+
+    return cnt, len(pool.created), pool.reopens
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog='%s %s' % (__script_name__, __version__),
+        description=__goal__, epilog='%(prog)s')
+    parser.add_argument('--input', required=True,
+                        help='Input pgn filename (required).')
+    parser.add_argument('--template', required=True,
+                        help='Output filename made of header tags, example "{Event}/{White}_vs_{Black}.pgn" '
+                             '(required). {Year} is the year of the Date tag, a missing tag is unknown.')
+    parser.add_argument('--output-dir', required=False,
+                        help='Folder of the output files (not required). If not specified it is split_<input>.')
+    parser.add_argument('--max-open', required=False, type=int, default=256,
+                        help='Maximum number of output files open at a time, default=256.')
+    parser.add_argument('-v', '--version', action='version',
+                        version=f'{__version__}')
+
+    args = parser.parse_args()
+
+    try:
+        check_template(args.template)
+    except ValueError as e:
+        parser.error(str(e))
+
+    if args.max_open < 1:
+        parser.error('--max-open must be at least 1.')
+
+    start_time = time.perf_counter()
+
+    infn = args.input
+    output_dir = args.output_dir
+    if output_dir is None:
+        output_dir = f'split_{Path(infn).stem}'
+
+    cnt, files, reopens = split_pgn(infn, args.template, output_dir, args.max_open)
+
+    print(f'Games: {cnt}, files: {files} in {output_dir}, reopened: {reopens}')
+    print(f'Done {infn}, Elapse (sec): {time.perf_counter() - start_time:0.3f}')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+
+
+"""
+pos_index.py
+
+Index the engine evals in pgn files by position and query them.
+
+Each mainline position is keyed by its polyglot zobrist hash. The eval,
+depth and engine found in the move comment are stored for the position
+the engine searched, that is the position before the move, and the eval
+is from the side to move in that position.
+
+
+Setup:
+  Install python 3.8 or newer
+
+
+Requirements:
+  python-chess==1.2.0
+
+
+Usage:
+    python pos_index.py --db evals.sqlite --input TCEC_Season_19_-_Superfinal.pgn --tcec
+    python pos_index.py --db evals.sqlite --fen "rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq - 0 1"
+    python pos_index.py --db evals.sqlite --disagree 1.0
+"""
+
+
+__version__ = 'v0.2.0'
+__script_name__ = 'posindex'
+__goal__ = 'Index engine evals in pgn files by position and query them.'
+
+
+import argparse
+import sqlite3
+import sys
+import time
+from pathlib import Path
+
+import chess.pgn
+import chess.polyglot
+
+# Code shared by the scripts is in scripts/pgncommon.
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'pgncommon'))
+from pgn_common import Quarantine, TooManyErrors, parse_comment, signed_key
+
+
+BATCH_SIZE = 10000  # Number of evals inserted per executemany.
+
+
+class PositionIndex:
+    def __init__(self, db):
+        self.con = sqlite3.connect(db)
+        self.con.execute('CREATE TABLE IF NOT EXISTS positions (key INTEGER PRIMARY KEY, epd TEXT)')
+        self.con.execute('CREATE TABLE IF NOT EXISTS evals (key INTEGER, engine TEXT, eval REAL,'
+                         ' depth INTEGER, source TEXT, game INTEGER, ply INTEGER)')
+        self.con.execute('CREATE INDEX IF NOT EXISTS evals_key ON evals (key, engine, eval)')
+
+        # A file indexed again replaces its rows. Indexes made before there
+        # was a unique index may have repeated rows, only the last is kept.
+        if self.con.execute("SELECT 1 FROM sqlite_master WHERE name = 'evals_game'").fetchone() is None:
+            with self.con:
+                self.con.execute('DELETE FROM evals WHERE rowid NOT IN'
+                                 ' (SELECT MAX(rowid) FROM evals GROUP BY source, game, ply)')
+                self.con.execute('CREATE UNIQUE INDEX evals_game ON evals (source, game, ply)')
+
+    def add_pgn(self, input_pgn, fmt='cutechess', spov=True, min_depth=1, max_errors=None):
+        """
+        Walk the mainline of each game and store the evals found in the
+        move comments. A game that fails is saved in the quarantine.
+        """
+        source = str(Path(input_pgn).resolve())
+        quarantine = Quarantine(input_pgn, f'quarantine_{Path(input_pgn).name}', max_errors)
+        positions, evals = [], []
+        cnt = 0
+
+        # Bytes that are not utf-8 are read as U+FFFD, tell() is the byte
+        # offset of a game.
+        try:
+            with open(input_pgn, encoding='utf-8', errors='replace') as pgn:
+                while True:
+                    start = pgn.tell()
+                    game = chess.pgn.read_game(pgn)
+                    if game is None:
+                        break
+
+                    cnt += 1
+                    print(f'game: {cnt}')
+
+                    try:
+                        game_positions, game_evals = self.game_evals(game, cnt, source, fmt, spov, min_depth)
+                    except Exception as e:
+                        quarantine.add(cnt, start, pgn.tell(), e)
+                        continue
+
+                    positions += game_positions
+                    evals += game_evals
+
+                    if len(evals) >= BATCH_SIZE:
+                        self.insert(positions, evals)
+                        positions, evals = [], []
+        finally:
+            self.insert(positions, evals)
+            quarantine.close()
+
+    def game_evals(self, game, cnt, source, fmt, spov, min_depth):
+        """
+        Returns the positions and evals rows of the game mainline.
+        """
+        positions, evals = [], []
+
+        board = game.board()
+        for node in game.mainline():
+            value = parse_comment(node.comment, fmt, board.turn, spov)
+
+            if value is not None:
+                move_eval, depth = value
+                if depth is None or depth >= min_depth:
+                    key = signed_key(chess.polyglot.zobrist_hash(board))
+                    engine = game.headers.get('White' if board.turn else 'Black', '?')
+                    positions.append((key, board.epd()))
+                    evals.append((key, engine, move_eval, depth, source, cnt, board.ply()))
+
+            board.push(node.move)
+
+        return positions, evals
+
+    def insert(self, positions, evals):
+        with self.con:
+            self.con.executemany('INSERT OR IGNORE INTO positions VALUES (?, ?)', positions)
+            self.con.executemany('INSERT OR REPLACE INTO evals VALUES (?, ?, ?, ?, ?, ?, ?)', evals)
+
+    def query_fen(self, fen):
+        """
+        Returns all evals stored for the position, highest depth first.
+        """
+        key = signed_key(chess.polyglot.zobrist_hash(chess.Board(fen)))
+
+        return self.con.execute(
+            'SELECT engine, eval, depth, source, game, ply FROM evals WHERE key = ?'
+            ' ORDER BY depth DESC', (key,)).fetchall()
+
+    def query_disagree(self, limit_eval, top=50):
+        """
+        Returns positions where the average evals of two engines differ by
+        more than limit_eval pawns, largest difference first.
+        """
+        return self.con.execute(
+            'SELECT p.epd, d.engines, d.spread, d.lo, d.hi FROM'
+            ' (SELECT key, COUNT(*) AS engines, MAX(e) - MIN(e) AS spread, MIN(e) AS lo, MAX(e) AS hi'
+            '  FROM (SELECT key, engine, AVG(eval) AS e FROM evals GROUP BY key, engine)'
+            '  GROUP BY key HAVING engines > 1 AND spread > ?) d'
+            ' JOIN positions p ON p.key = d.key'
+            ' ORDER BY d.spread DESC LIMIT ?', (limit_eval, top)).fetchall()
+
+    def close(self):
+        self.con.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog='%s %s' % (__script_name__, __version__),
+        description=__goal__, epilog='%(prog)s')
+    parser.add_argument('--db', required=True, type=str,
+                        help='Index sqlite filename (required).')
+    parser.add_argument('--input', required=False, type=str, nargs='+',
+                        help='Pgn filenames to add to the index.')
+    parser.add_argument('--min-depth', required=False, type=int, default=1,
+                        help='Minimum depth to consider the eval, default=1.')
+    parser.add_argument('--tcec', action='store_true',
+                        help='Use this flag if pgn is from tcec.')
+    parser.add_argument('--lichess', action='store_true',
+                        help='Use this flag if pgn is from lichess.')
+    parser.add_argument('--chessbase', action='store_true',
+                        help='Use this flag if pgn is from chessbase.')
+    parser.add_argument('--wpov', action='store_true',
+                        help='Use this flag if cutechess style scores in the game are in wpov.')
+    parser.add_argument('--fen', required=False, type=str,
+                        help='Print all evals of this position.')
+    parser.add_argument('--disagree', required=False, type=float,
+                        help='Print positions where engines disagree by more than this eval in pawn unit.')
+    parser.add_argument('--top', required=False, type=int, default=50,
+                        help='Number of positions printed by --disagree, default=50.')
+    parser.add_argument('--max-errors', required=False, type=int,
+                        help='Stop when more than this number of games of a file fail, default is no limit. '
+                             'Games that fail are saved in quarantine_<input> with a log.')
+    parser.add_argument('-v', '--version', action='version',
+                        version=f'{__version__}')
+
+    args = parser.parse_args()
+
+    fmt = 'cutechess'
+    if args.tcec:
+        fmt = 'tcec'
+    elif args.lichess:
+        fmt = 'lichess'
+    elif args.chessbase:
+        fmt = 'chessbase'
+
+    start_time = time.perf_counter()
+    index = PositionIndex(args.db)
+
+    for fn in args.input or []:
+        try:
+            index.add_pgn(fn, fmt, spov=not args.wpov, min_depth=args.min_depth,
+                          max_errors=args.max_errors)
+        except TooManyErrors as e:
+            print(f'Aborted {fn}: {e}')
+            break
+        print(f'Done {fn}, Elapse (sec): {time.perf_counter() - start_time:0.3f}')
+
+    if args.fen is not None:
+        print(f'{"Engine":<40} {"Eval":>8} {"Depth":>6}  Source')
+        for engine, move_eval, depth, source, game, ply in index.query_fen(args.fen):
+            depth = '-' if depth is None else depth
+            print(f'{engine:<40} {move_eval:>8.2f} {depth:>6}  {source} game {game} ply {ply}')
+
+    if args.disagree is not None:
+        print(f'{"Spread":>7} {"Min":>8} {"Max":>8} {"Engines":>7}  EPD')
+        for epd, engines, spread, lo, hi in index.query_disagree(args.disagree, args.top):
+            print(f'{spread:>7.2f} {lo:>8.2f} {hi:>8.2f} {engines:>7}  {epd}')
+
+    index.close()
+
+
+if __name__ == "__main__":
+    main()